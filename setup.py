@@ -28,6 +28,11 @@ setuptools.setup(
         "pytest>=5.3.2",
         "SQLAlchemy>=1.3.12",
     ],
-    package_data={"skrate": ["static/*", "templates/*", "rates_by_trick.sql"]},
+    extras_require={
+        "recommend": ["numpy>=1.17"],
+    },
+    package_data={
+        "skrate": ["static/*", "static/vendor/*", "templates/*", "*.sql"]
+    },
     include_package_data=True,
 )
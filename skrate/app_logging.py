@@ -0,0 +1,148 @@
+"""App logging through a queue, so request threads never wait on log I/O.
+
+Log records go onto a queue from the request thread, and a background listener
+thread writes them to a rotating log file (and stderr). With SKRATE_LOG_JSON set,
+lines are JSON objects carrying the request id, path and, on the per-request
+line, its duration. Apps in a process share the "skrate" logger, so the file
+handling is set up once per log file, by the first app using it.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+import uuid
+from typing import Any, Dict, Tuple
+
+from flask import Flask, Response, current_app, g, has_request_context, request
+from flask.logging import default_handler
+
+# Request header to take the request id from, echoed back in the response
+REQUEST_ID_HEADER = "X-Request-Id"
+
+_SERVER_LOG_FORMAT = "'%(asctime)s %(levelname)s: %(message)s'"
+
+# Logger, its queue handler and listener thread writing out records, by log file
+_listeners: Dict[str, Tuple[logging.Logger, logging.handlers.QueueHandler,
+                            logging.handlers.QueueListener]] = {}
+
+
+class _RequestInfoFilter(logging.Filter):
+    """Tag records with the id and path of the request logging them, if any."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Add request info to record, runs on the thread logging it."""
+        if has_request_context():
+            record.request_id = getattr(g, "skrate_request_id", None)
+            record.path = request.path
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        """Format record as JSON, with request info if it has any."""
+        entry: Dict[str, Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for key in ("request_id", "path", "duration_ms", "status"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def _start_listener(app: Flask) -> logging.handlers.QueueListener:
+    """Start a listener thread writing queued records to the app's log file.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    formatter = logging.Formatter(_SERVER_LOG_FORMAT)
+    if app.config["SKRATE_LOG_JSON"]:
+        formatter = JsonFormatter()
+    file_handler = logging.handlers.RotatingFileHandler(
+        app.config["SKRATE_LOG_FILE"],
+        maxBytes=app.config["SKRATE_LOG_MAX_BYTES"],
+        backupCount=app.config["SKRATE_LOG_BACKUP_COUNT"])
+    handlers = [file_handler]
+    # Only the first listener echoes to stderr, else lines show up repeatedly
+    if not _listeners:
+        handlers.append(logging.StreamHandler(sys.stderr))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    listener = logging.handlers.QueueListener(queue.SimpleQueue(),
+                                              *handlers,
+                                              respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+@atexit.register
+def stop_listeners() -> None:
+    """Write out queued records and stop listener threads, e.g. at exit."""
+    while _listeners:
+        _, (logger, queue_handler, listener) = _listeners.popitem()
+        logger.removeHandler(queue_handler)
+        listener.stop()
+
+
+def _start_request_timer() -> None:
+    """Before request, note its id and start time for logging."""
+    g.skrate_request_id = request.headers.get(REQUEST_ID_HEADER) or \
+            uuid.uuid4().hex
+    g.skrate_request_start = time.perf_counter()
+
+
+def _log_request(response: Response) -> Response:
+    """After request, log it with its duration and echo back its id."""
+    if "skrate_request_start" not in g:
+        return response  # before request handlers cut short
+    duration_ms = (time.perf_counter() - g.skrate_request_start) * 1000.0
+    current_app.logger.info("%s %s %s in %.1f ms",
+                            request.method,
+                            request.path,
+                            response.status_code,
+                            duration_ms,
+                            extra={
+                                "duration_ms": round(duration_ms, 3),
+                                "status": response.status_code
+                            })
+    response.headers[REQUEST_ID_HEADER] = g.skrate_request_id
+    return response
+
+
+def configure_app_logger(app: Flask) -> None:
+    """Configure app logger to queue records for a background writer thread.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    log_level = app.config["SKRATE_LOG_LEVEL"]
+    log_file = app.config["SKRATE_LOG_FILE"]
+    app.logger.setLevel(log_level)
+    # Flask's own handler writes inline, stderr goes through the queue instead
+    app.logger.removeHandler(default_handler)
+
+    if log_file not in _listeners:
+        listener = _start_listener(app)
+        queue_handler = logging.handlers.QueueHandler(listener.queue)
+        queue_handler.addFilter(_RequestInfoFilter())
+        app.logger.addHandler(queue_handler)
+        _listeners[log_file] = (app.logger, queue_handler, listener)
+    for handler in _listeners[log_file][2].handlers:
+        handler.setLevel(log_level)
+
+    app.before_request(_start_request_timer)
+    app.after_request(_log_request)
@@ -0,0 +1,222 @@
+"""Bundled, minified static assets with content-hashed URLs, and compression.
+
+Third-party assets are vendored into static/vendor, so pages load without any
+CDN. At app creation the CSS and JS are each bundled with Skrate's own into a
+single file, named by a hash of its content, so it can be cached for good (a
+change makes a new name). Text responses (pages, fragments, JSON) are gzipped
+for clients accepting it.
+"""
+import base64
+import gzip
+import hashlib
+import os
+import re
+import urllib.request
+from typing import Dict, List, Mapping, NamedTuple, Sequence, Tuple
+
+from flask import Flask, Response, abort, current_app, request, url_for
+
+# Key under app.extensions holding the bundles for that app
+_EXTENSION_KEY = "skrate_assets"
+
+# Bundles served, by name, from these files under the static folder in order
+_BUNDLE_SOURCES: Mapping[str, Sequence[str]] = {
+    "skrate.css": ("vendor/bootstrap.min.css", "skrate.css"),
+    "skrate.js": ("vendor/jquery.min.js", "skrate.js"),
+}
+
+# Third-party assets to vendor by run_skrate vendor-assets, (URL, SRI hash)
+DOWNLOADED_ASSETS: Mapping[str, Tuple[str, str]] = {
+    "vendor/bootstrap.min.css": (
+        "https://stackpath.bootstrapcdn.com/bootstrap/4.3.1/css/bootstrap.min.css",
+        "sha384-ggOyR0iXCbMQv3Xipma34MD+dH/1fQ784/j6cY/iJTQUOhcWr7x9JvoRxT2MZw1T"
+    ),
+}
+
+_CONTENT_TYPES = {".css": "text/css", ".js": "application/javascript"}
+
+# Bundles never change under a name, so let clients keep them a year
+_BUNDLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Compress responses of these types, at least this big
+_COMPRESSIBLE_MIMETYPES = ("text/html", "text/css", "application/javascript",
+                           "application/json")
+_MIN_COMPRESS_BYTES = 500
+
+
+class _Bundle(NamedTuple):
+    """A built bundle, plain and gzipped, named by content hash."""
+
+    filename: str
+    content_type: str
+    content: bytes
+    gzipped: bytes
+
+
+class _Assets(NamedTuple):
+    """An app's bundles, by name and by hashed filename, and missing sources."""
+
+    by_name: Mapping[str, _Bundle]
+    by_filename: Mapping[str, _Bundle]
+    missing: Sequence[str]
+
+
+def _minify(source: str, extension: str) -> str:
+    """Strip comments and whitespace from Skrate's own CSS or JS.
+
+    Conservative, keeps line breaks in JS so semicolon insertion is unchanged.
+
+    Args:
+        source: the CSS or JS text
+        extension: ".css" or ".js"
+
+    """
+    source = re.sub(r"/\*.*?\*/", "", source, flags=re.DOTALL)
+    if extension == ".css":
+        source = re.sub(r"\s+", " ", source)
+        return re.sub(r"\s*([{};:,])\s*", r"\1", source).strip()
+    lines = (line.strip() for line in source.splitlines())
+    return "\n".join(
+        line for line in lines if line and not line.startswith("//"))
+
+
+def _build_bundle(static_folder: str, name: str,
+                  sources: Sequence[str]) -> Tuple[_Bundle, List[str]]:
+    """Concatenate a bundle's sources, minifying Skrate's own.
+
+    Args:
+        static_folder: directory sources are relative to
+        name: bundle name, e.g. skrate.js
+        sources: files making up the bundle, in order
+
+    Returns:
+        The bundle, and any sources missing (not vendored yet)
+
+    """
+    stem, extension = os.path.splitext(name)
+    parts = []
+    missing = []
+    for source in sources:
+        path = os.path.join(static_folder, source)
+        if not os.path.exists(path):
+            missing.append(source)
+            continue
+        with open(path, encoding="utf-8") as source_file:
+            text = source_file.read()
+        if ".min." not in source:
+            text = _minify(text, extension)
+        # Source maps of vendored files aren't served
+        parts.append(re.sub(r"^//# sourceMappingURL=.*$", "", text, flags=re.M))
+    content = "\n".join(parts).encode("utf-8")
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return _Bundle(f"{stem}.{digest}{extension}", _CONTENT_TYPES[extension],
+                   content, gzip.compress(content, mtime=0)), missing
+
+
+def asset_url(name: str) -> str:
+    """Get the content-hashed URL of a bundle, for templates.
+
+    Args:
+        name: bundle name, e.g. skrate.js
+
+    """
+    assets: _Assets = current_app.extensions[_EXTENSION_KEY]
+    return url_for("serve_bundle", filename=assets.by_name[name].filename)
+
+
+def asset_missing(source: str) -> bool:
+    """Get whether a bundle source isn't vendored, for templates to fall back.
+
+    Args:
+        source: file under the static folder, e.g. vendor/bootstrap.min.css
+
+    """
+    return source in current_app.extensions[_EXTENSION_KEY].missing
+
+
+def _serve_bundle(filename: str) -> Response:
+    """Serve a bundle by content-hashed name, cacheable for good."""
+    bundle = current_app.extensions[_EXTENSION_KEY].by_filename.get(filename)
+    if bundle is None:
+        abort(404)
+    response = Response(bundle.content, content_type=bundle.content_type)
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        response.set_data(bundle.gzipped)
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = _BUNDLE_CACHE_CONTROL
+    return response
+
+
+def _compress_response(response: Response) -> Response:
+    """After request, gzip a text response if the client accepts it."""
+    if response.direct_passthrough or response.status_code != 200 or \
+            "Content-Encoding" in response.headers or \
+            response.mimetype not in _COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add("Accept-Encoding")
+    if "gzip" not in request.headers.get("Accept-Encoding", ""):
+        return response
+    data = response.get_data()
+    if len(data) < _MIN_COMPRESS_BYTES:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+def init_assets(app: Flask) -> None:
+    """Build the app's asset bundles and serve them, and compress responses.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    bundles: Dict[str, _Bundle] = {}
+    missing: List[str] = []
+    for name, sources in _BUNDLE_SOURCES.items():
+        bundles[name], bundle_missing = _build_bundle(app.static_folder, name,
+                                                      sources)
+        missing.extend(bundle_missing)
+    if missing:
+        app.logger.warning(
+            "Not vendored, using CDN: %s (run run_skrate vendor-assets)",
+            ", ".join(missing))
+    app.extensions[_EXTENSION_KEY] = _Assets(
+        bundles, {bundle.filename: bundle for bundle in bundles.values()},
+        missing)
+
+    app.add_url_rule("/assets/<filename>", "serve_bundle", _serve_bundle)
+    app.jinja_env.globals.update(asset_url=asset_url,
+                                 asset_missing=asset_missing)
+    app.after_request(_compress_response)
+
+
+def vendor_assets(static_folder: str) -> List[str]:
+    """Download third-party assets into the static folder, checking hashes.
+
+    Args:
+        static_folder: directory to put them under
+
+    Returns:
+        Files written
+
+    Raises:
+        ValueError: if a download doesn't match its pinned hash
+
+    """
+    written = []
+    for source, (url, integrity) in DOWNLOADED_ASSETS.items():
+        with urllib.request.urlopen(url) as download:
+            content = download.read()
+        algorithm, expected = integrity.split("-", 1)
+        actual = base64.b64encode(hashlib.new(algorithm,
+                                              content).digest()).decode()
+        if actual != expected:
+            raise ValueError(f"Downloaded {url} does not match {integrity}")
+        path = os.path.join(static_folder, source)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as asset_file:
+            asset_file.write(content)
+        written.append(path)
+    return written
@@ -0,0 +1,215 @@
+"""Write-behind buffer of practice attempts, inserted in batches.
+
+Attempts outside games are collected in memory and written by a background
+thread in one multi-row insert and commit per batch, every few milliseconds or
+once enough are waiting, instead of a commit per click. Game attempts don't go
+through here, past self's choices need them in the database right away.
+
+Reads of a user's stats add in the user's buffered attempts (see
+read_through), so counts are never stale. Buffered attempts not yet written
+when the process dies are lost, the buffer is flushed at exit and by close.
+"""
+import atexit
+import contextlib
+import datetime
+import logging
+import threading
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+from flask import Flask
+
+# Key under app.extensions holding the attempt buffer for that app
+_EXTENSION_KEY = "skrate_attempt_buffer"
+
+# After failing to write a batch, wait this long before trying again
+_RETRY_SECONDS = 1.0
+
+
+class BufferedAttempt(NamedTuple):
+    """An attempt waiting to be written."""
+    user_id: int
+    trick_id: int
+    landed: bool
+    time_of_attempt: datetime.datetime
+    # Client's key for the request, if any, and JSON of its response
+    request_key: Optional[str] = None
+    response: Optional[str] = None
+
+
+class AttemptBuffer:
+    """Attempts waiting to be written, and the thread writing them."""
+
+    def __init__(self, write: Callable[[List[BufferedAttempt]],
+                                       None], flush_seconds: float,
+                 max_rows: int, logger: logging.Logger) -> None:
+        """Initialize an empty buffer and start its writer thread.
+
+        Args:
+            write: inserts and commits a batch of attempts, committing within
+                committing()
+            flush_seconds: write attempts at most this long after the first
+                of a batch is buffered
+            max_rows: write as soon as this many attempts are waiting
+            logger: where to log failures to write
+
+        """
+        self._write = write
+        self._logger = logger
+        self.flush_seconds = flush_seconds
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._committed = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()  # one batch written at a time
+        self._pending: List[BufferedAttempt] = []
+        self._in_flight: List[BufferedAttempt] = []
+        # Odd while a batch commits, so reads can tell if one did meanwhile
+        self._commits = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._flush_forever, daemon=True)
+        self._thread.start()
+
+    def add(self,
+            user_id: int,
+            trick_id: int,
+            landed: bool,
+            request_key: Optional[str] = None,
+            response: Optional[str] = None) -> None:
+        """Buffer an attempt, attempted now.
+
+        Args:
+            user_id: id of the user attempting
+            trick_id: id of the trick attempted
+            landed: whether landed
+            request_key: the client's key for the request, if any
+            response: JSON of the request's response, if a key
+
+        """
+        attempt = BufferedAttempt(user_id, trick_id, landed,
+                                  datetime.datetime.utcnow(), request_key,
+                                  response)
+        with self._lock:
+            self._pending.append(attempt)
+            if len(self._pending) in (1, self.max_rows):
+                self._wake.notify()
+
+    def _flush_forever(self) -> None:
+        """Write batches as attempts come in, until closed."""
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._wake.wait()
+                # Let a batch gather
+                if not self._closed and len(self._pending) < self.max_rows:
+                    self._wake.wait(self.flush_seconds)
+                closed = self._closed
+            try:
+                self.flush()
+            except Exception:
+                self._logger.exception("Failed to write buffered attempts")
+                if not closed:
+                    with self._lock:
+                        self._wake.wait(_RETRY_SECONDS)
+            if closed:
+                return
+
+    def flush(self) -> int:
+        """Write all buffered attempts now.
+
+        If writing fails the attempts stay buffered, for the next try.
+
+        Returns:
+            Number of attempts written
+
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._in_flight = batch
+            if not batch:
+                return 0
+            try:
+                self._write(batch)
+            except Exception:
+                with self._lock:
+                    self._pending = self._in_flight + self._pending
+                    self._in_flight = []
+                raise
+            return len(batch)
+
+    @contextlib.contextmanager
+    def committing(self) -> Iterator[None]:
+        """Within this context, commit the batch being written."""
+        with self._lock:
+            self._commits += 1
+        try:
+            yield
+            with self._lock:
+                self._in_flight = []
+        finally:
+            with self._lock:
+                self._commits += 1
+                self._committed.notify_all()
+
+    def read_through(self, read: Callable[[], Tuple[int, int]], user_id: int,
+                     trick_id: int) -> Tuple[int, int]:
+        """Get attempts and lands at a trick, written and buffered.
+
+        The database read is repeated if a batch committed while it ran, so
+        no attempt is counted twice, or missed.
+
+        Args:
+            read: gets attempts and lands from the database
+            user_id: id of the user
+            trick_id: id of the trick
+
+        """
+        while True:
+            with self._lock:
+                while self._commits % 2:
+                    self._committed.wait()
+                commits = self._commits
+            attempts, lands = read()
+            with self._lock:
+                if self._commits != commits:
+                    continue
+                for attempt in self._in_flight + self._pending:
+                    if attempt.user_id == user_id and \
+                            attempt.trick_id == trick_id:
+                        attempts += 1
+                        lands += attempt.landed
+                return attempts, lands
+
+    def close(self) -> None:
+        """Write out what's buffered and stop the writer thread."""
+        with self._lock:
+            self._closed = True
+            self._wake.notify()
+        self._thread.join()
+
+
+def init_attempt_buffer(app: Flask, write: Callable[[List[BufferedAttempt]],
+                                                    None], flush_seconds: float,
+                        max_rows: int) -> None:
+    """Give the app an attempt buffer, closed at exit.
+
+    Args:
+        app: the Flask web server application object
+        write: inserts and commits a batch of attempts, see AttemptBuffer
+        flush_seconds: write attempts at most this long after buffering
+        max_rows: write as soon as this many attempts are waiting
+
+    """
+    buffer = AttemptBuffer(write, flush_seconds, max_rows, app.logger)
+    app.extensions[_EXTENSION_KEY] = buffer
+    atexit.register(buffer.close)
+
+
+def get_attempt_buffer(app: Flask) -> Optional[AttemptBuffer]:
+    """Get the attempt buffer of an app, None if attempts are written at once.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    return app.extensions.get(_EXTENSION_KEY)
@@ -0,0 +1,144 @@
+"""In-memory cache of rendered view fragments, e.g. trick stats and game views.
+
+Keys carry a version that changes whenever an attempt is recorded for the user or
+game, so stale fragments are never served, just left to age out of the LRU order.
+Versions live in this process's memory, assuming a single server process.
+The same keys make the views' ETags, so clients can revalidate with a version
+lookup instead of a render.
+"""
+import collections
+import threading
+import uuid
+from typing import Callable, Dict, Hashable, Mapping, Optional, Tuple
+
+from flask import Flask
+
+# Key under app.extensions holding the cache for that app
+_EXTENSION_KEY = "skrate_fragment_cache"
+
+# Default most fragments to hold before evicting least recently used
+_DEFAULT_MAX_ENTRIES = 4096
+
+
+class FragmentCache:
+    """Bounded least-recently-used cache of rendered fragments, with hit rate."""
+
+    def __init__(self, max_entries: int = _DEFAULT_MAX_ENTRIES) -> None:
+        """Initialize an empty fragment cache.
+
+        Args:
+            max_entries: most fragments to hold before evicting oldest
+
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._fragments: "collections.OrderedDict[Hashable, str]" = \
+                collections.OrderedDict()
+        self._stats_versions: Dict[int, int] = {}
+        self._game_versions: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        # Versions restart at 0 with the process, so tags carry the process
+        self._etag_prefix = uuid.uuid4().hex[:12]
+
+    def stats_version(self, user_id: int) -> int:
+        """Get version of a user's trick stats, changes on every attempt.
+
+        Args:
+            user_id: id of the user
+
+        """
+        with self._lock:
+            return self._stats_versions.get(user_id, 0)
+
+    def game_version(self, game_id: Optional[int]) -> int:
+        """Get version of a game, i.e. attempts recorded in it so far.
+
+        Args:
+            game_id: id of the game, None if no game (version always 0)
+
+        """
+        with self._lock:
+            return self._game_versions.get(game_id, 0) if game_id else 0
+
+    def note_attempt(self, user_id: int, game_id: Optional[int]) -> None:
+        """Move versions on after an attempt, so old fragments are not served.
+
+        Args:
+            user_id: id of the user the attempt was recorded for
+            game_id: id of the game it was part of, if any
+
+        """
+        with self._lock:
+            self._stats_versions[user_id] = self._stats_versions.get(
+                user_id, 0) + 1
+            if game_id is not None:
+                self._game_versions[game_id] = self._game_versions.get(
+                    game_id, 0) + 1
+
+    def etag(self, key: Tuple[Hashable, ...]) -> str:
+        """Get an entity tag for a view, changes whenever its fragment would.
+
+        Args:
+            key: cache key of the view, including versions from above
+
+        """
+        return "-".join([self._etag_prefix] + [str(part) for part in key])
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str]) -> str:
+        """Get fragment cached under key, else render it and cache it.
+
+        Args:
+            key: cache key, should include a version from above
+            render: function rendering the fragment on a miss
+
+        """
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+
+        # Render outside the lock, a concurrent duplicate render is harmless
+        fragment = render()
+        with self._lock:
+            self._fragments[key] = fragment
+            self._fragments.move_to_end(key)
+            while len(self._fragments) > self.max_entries:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def stats(self) -> Mapping[str, float]:
+        """Get counters on how well the cache is doing."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._fragments),
+                "max_entries": self.max_entries
+            }
+
+
+def init_fragment_cache(app: Flask, max_entries: int) -> None:
+    """Give the app a new, empty fragment cache.
+
+    Args:
+        app: the Flask web server application object
+        max_entries: most fragments to hold before evicting oldest
+
+    """
+    app.extensions[_EXTENSION_KEY] = FragmentCache(max_entries)
+
+
+def get_fragment_cache(app: Flask) -> FragmentCache:
+    """Get the fragment cache of an app, making one if not set up yet.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    return app.extensions.setdefault(_EXTENSION_KEY, FragmentCache())
@@ -2,11 +2,13 @@
 
 Two-player only for now, versus your past self for progression check.
 """
+import contextlib
+import datetime
 import random
 import os
-from typing import Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
-from flask import Flask
+from flask import Flask, current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 
 # Letters to get in a game of SKATE
@@ -82,20 +84,20 @@ class GameState:
             GameFeedMessage(f"[Turn {self.turn_idx}]: {message}", msg_type))
 
     def apply_attempt(self, trick_id: int, trick_name: str, landed: bool,
-                      user: str) -> bool:
+                      is_past_self: bool) -> bool:
         """Update the game state given an attempt that just happened.
         
         Args:
             trick_id: the id of the trick tried
             trick_name: the name of the trick being tried
             landed: whether or not the trick was landed
-            user: who was attempting the trick
+            is_past_self: whether the past self was attempting the trick
 
         Returns:
             Whether the game is over
 
         """
-        user_attempt = user == self.user_name
+        user_attempt = not is_past_self
         attempter, opponent = _YOU_NAMES if user_attempt else _YOU_NAMES[::-1]
 
         if trick_id in self.trick_ids_used_up:
@@ -156,6 +158,24 @@ class GameState:
             LETTERS)
 
 
+@contextlib.contextmanager
+def app_context(app: Flask) -> Iterator[None]:
+    """Run in an app context of app, reusing the current one if it's app's.
+
+    A context of our own would end the database session on teardown, rolling
+    back (and unlocking) any transaction the caller has open.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    if has_app_context() and current_app._get_current_object() is app:
+        yield
+    else:
+        with app.app_context():
+            yield
+
+
 def _read_sql_resource(query_name: str) -> str:
     """Read a .sql file from directory of this python file.
 
@@ -168,74 +188,111 @@ def _read_sql_resource(query_name: str) -> str:
         return qfile.read()
 
 
-def game_trick_choice(app: Flask, user: str, tricks_prohibited: List[int],
-                      db: SQLAlchemy) -> int:
-    """Find the trick the user is most likely to land.
+def _rates_by_trick(
+        user_id: int,
+        as_of: Optional[datetime.datetime],
+        db: SQLAlchemy,
+        newest_skipped: int = _RECENT_ATTEMPTS_WINDOW_NEWEST) -> Any:
+    """Run the rates_by_trick query, in an app context.
 
     Args:
-        app: the Flask web server application object
-        user: the user trying the trick
-        tricks_prohibited: Tricks can't use (e.g. already hit in game)
+        user_id: id of the user to get land rates of
+        as_of: only count attempts before this time, None for all
         db: the persistence layer connection
+        newest_skipped: latest attempts at each trick left out of its window,
+            one fewer than usual gives the rates after another attempt
 
     """
-    with app.app_context():
-        statement = _read_sql_resource("rates_by_trick")
-        result = db.session.execute(
-            statement, {
-                "username": user,
-                "nlimit": _RECENT_ATTEMPTS_WINDOW_OLDEST,
-                "nmin": _RECENT_ATTEMPTS_WINDOW_NEWEST
-            })
-        for row in result:
-            if row[0] not in tricks_prohibited and random.uniform(
-                    0, 1) > _TRICK_RANDOM_SKIP:
-                return row[0]
+    window = _RECENT_ATTEMPTS_WINDOW_OLDEST - _RECENT_ATTEMPTS_WINDOW_NEWEST
+    return db.session.execute(
+        _read_sql_resource("rates_by_trick"), {
+            "user_id": user_id,
+            "as_of": as_of or datetime.datetime.max,
+            "nlimit": newest_skipped + window,
+            "nmin": newest_skipped
+        })
+
+
+def choose_trick(trick_ids_by_rate: Iterable[int],
+                 tricks_prohibited: List[int]) -> int:
+    """Pick the best trick allowed, sometimes skipping to the next best.
+
+    Args:
+        trick_ids_by_rate: trick ids, best land rate first
+        tricks_prohibited: Tricks can't use (e.g. already hit in game)
+
+    """
+    for trick_id in trick_ids_by_rate:
+        if trick_id not in tricks_prohibited and random.uniform(
+                0, 1) > _TRICK_RANDOM_SKIP:
+            return trick_id
 
     raise RuntimeError(
         "All tricks used up! Crazy outcome expected to never happen!")
 
 
-def get_odds_lookup_dict(app: Flask, user: str,
-                         db: SQLAlchemy) -> Dict[int, float]:
-    """Get dict to look up odds of landing trick by trick id.
+def game_trick_choice(app: Flask,
+                      user_id: int,
+                      tricks_prohibited: List[int],
+                      db: SQLAlchemy,
+                      as_of: Optional[datetime.datetime] = None) -> int:
+    """Find the trick the user is most likely to land.
+
+    Args:
+        app: the Flask web server application object
+        user_id: id of the user trying the trick
+        tricks_prohibited: Tricks can't use (e.g. already hit in game)
+        db: the persistence layer connection
+        as_of: the user as of this time, None for now
+
+    """
+    with app_context(app):
+        return choose_trick(
+            (row[0] for row in _rates_by_trick(user_id, as_of, db)),
+            tricks_prohibited)
+
+
+def get_odds_lookup_dict(
+        app: Flask,
+        user_id: int,
+        db: SQLAlchemy,
+        as_of: Optional[datetime.datetime] = None,
+        newest_skipped: int = _RECENT_ATTEMPTS_WINDOW_NEWEST
+) -> Dict[int, float]:
+    """Get dict to look up odds of landing trick by trick id, best odds first.
 
     Args:
         app: The flask server application
-        user: the user to look up land rate for
+        user_id: id of the user to look up land rate for
         db: the persistence layer connection
+        as_of: the user as of this time, None for now
+        newest_skipped: latest attempts at each trick left out of its window,
+            see _rates_by_trick
 
     """
-    with app.app_context():
-        statement = _read_sql_resource("rates_by_trick")
-        result = db.session.execute(
-            statement, {
-                "username": user,
-                "nlimit": _RECENT_ATTEMPTS_WINDOW_OLDEST,
-                "nmin": _RECENT_ATTEMPTS_WINDOW_NEWEST
-            })
+    with app_context(app):
+        result = _rates_by_trick(user_id, as_of, db, newest_skipped)
         return {row[0]: row[1] for row in result}
 
 
-def get_odds(app: Flask, user: str, trick_id: int, db: SQLAlchemy) -> float:
+def get_odds(app: Flask,
+             user_id: int,
+             trick_id: int,
+             db: SQLAlchemy,
+             as_of: Optional[datetime.datetime] = None) -> float:
     """Get odds of user landing a trick based on recent attempts.
 
     Args:
         app: the Flask web server application object
-        user: the user trying the trick
+        user_id: id of the user trying the trick
         trick_id: which trick is in question
         db: the persistence layer connection
+        as_of: the user as of this time, None for now
 
     """
-    with app.app_context():
+    with app_context(app):
         # Would be more efficient to use different query only on one trick, but trivial scale for now
-        statement = _read_sql_resource("rates_by_trick")
-        result = db.session.execute(
-            statement, {
-                "username": user,
-                "nlimit": _RECENT_ATTEMPTS_WINDOW_OLDEST,
-                "nmin": _RECENT_ATTEMPTS_WINDOW_NEWEST
-            })
+        result = _rates_by_trick(user_id, as_of, db)
         for row in result:
             if row[0] == trick_id:
                 return row[1]
@@ -0,0 +1,116 @@
+"""In-memory store of responses to write requests, by client request key.
+
+A client sends a fresh key with each write (e.g. an attempt), and the same key
+again when it retries, so a retry gets the first response back instead of
+writing twice. Recent keys are kept here, in least-recently-used order, and
+all keys in the request_key table (see models), which settles retries this
+process never saw, e.g. after a restart or from another worker.
+"""
+import collections
+import threading
+from typing import Any, Mapping, Optional, Tuple
+
+from flask import Flask
+
+# Key under app.extensions holding the store for that app
+_EXTENSION_KEY = "skrate_idempotency_store"
+
+# Default most responses to hold before evicting least recently used
+_DEFAULT_MAX_ENTRIES = 10000
+
+# A response to a request, as sent (JSON serializable)
+Response = Mapping[str, Any]
+
+
+class IdempotencyStore:
+    """Bounded least-recently-used store of responses by user and request key."""
+
+    def __init__(self, max_entries: int = _DEFAULT_MAX_ENTRIES) -> None:
+        """Initialize an empty store.
+
+        Args:
+            max_entries: most responses to hold before evicting oldest
+
+        """
+        self.max_entries = max_entries
+        self._responses: "collections.OrderedDict[Tuple[int, str], Response]" = \
+                collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, key: str) -> Optional[Response]:
+        """Get the response to a request already done, None if not seen.
+
+        Args:
+            user_id: id of the user making the request
+            key: the client's key for the request
+
+        """
+        with self._lock:
+            response = self._responses.get((user_id, key))
+            if response is not None:
+                self._responses.move_to_end((user_id, key))
+            return response
+
+    def put(self, user_id: int, key: str, response: Response) -> None:
+        """Keep the response to a request just done.
+
+        Args:
+            user_id: id of the user making the request
+            key: the client's key for the request
+            response: what was sent back
+
+        """
+        with self._lock:
+            self._put(user_id, key, response)
+
+    def put_if_absent(self, user_id: int, key: str,
+                      response: Response) -> Optional[Response]:
+        """Keep the response to a request about to be done, unless seen.
+
+        Claims the key in one step, for requests that can't fail once started,
+        so concurrent retries can't both go ahead.
+
+        Args:
+            user_id: id of the user making the request
+            key: the client's key for the request
+            response: what will be sent back
+
+        Returns:
+            The earlier response if the key was seen, else None
+
+        """
+        with self._lock:
+            earlier = self._responses.get((user_id, key))
+            if earlier is not None:
+                self._responses.move_to_end((user_id, key))
+                return earlier
+            self._put(user_id, key, response)
+            return None
+
+    def _put(self, user_id: int, key: str, response: Response) -> None:
+        """Keep a response, evicting the oldest if full, with lock held."""
+        self._responses[(user_id, key)] = response
+        self._responses.move_to_end((user_id, key))
+        while len(self._responses) > self.max_entries:
+            self._responses.popitem(last=False)
+
+
+def init_idempotency_store(app: Flask, max_entries: int) -> None:
+    """Give the app a new, empty idempotency store.
+
+    Args:
+        app: the Flask web server application object
+        max_entries: most responses to hold before evicting oldest
+
+    """
+    app.extensions[_EXTENSION_KEY] = IdempotencyStore(max_entries)
+
+
+def get_idempotency_store(app: Flask) -> IdempotencyStore:
+    """Get the idempotency store of an app, making one if not set up yet.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    return app.extensions.setdefault(_EXTENSION_KEY, IdempotencyStore())
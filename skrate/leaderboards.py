@@ -0,0 +1,267 @@
+"""In-memory leaderboards across users, updated as attempts are recorded.
+
+Rankings are kept sorted as they change, so reading the top N is a slice of a
+list whatever the number of users. They're loaded from the database by one scan
+on first use (see models.get_loaded_leaderboards), then kept up to date by
+note_attempt and note_game_over. Like the fragment cache, this assumes a single
+server process records all attempts.
+"""
+import bisect
+import collections
+import threading
+from typing import (Deque, Dict, Generic, Hashable, Iterable, List, Optional,
+                    Set, Tuple, TypeVar)
+
+from flask import Flask
+
+# Key under app.extensions holding the leaderboards for that app
+_EXTENSION_KEY = "skrate_leaderboards"
+
+# Default fewest attempts at a trick to be ranked on it
+_DEFAULT_MIN_ATTEMPTS = 20
+
+# Default attempts in the first and latest windows compared for improvement
+_DEFAULT_IMPROVEMENT_WINDOW = 50
+
+# Default size of the attempt id blocks (one per shard) loads are tracked by
+_DEFAULT_ID_BLOCK = 0
+
+# Sort key of a ranked member, ascending sorts first
+_Key = TypeVar("_Key", bound=Hashable)
+
+
+class _Ranking(Generic[_Key]):
+    """Members (user ids) kept sorted by a key, lowest key first."""
+
+    def __init__(self) -> None:
+        """Initialize an empty ranking."""
+        self._keys: Dict[int, _Key] = {}
+        self._sorted: List[Tuple[_Key, int]] = []
+
+    def set(self, member: int, key: _Key) -> None:
+        """Add a member, or move them to their new key.
+
+        Args:
+            member: id of member to rank
+            key: member's sort key
+
+        """
+        self.discard(member)
+        self._keys[member] = key
+        bisect.insort(self._sorted, (key, member))
+
+    def discard(self, member: int) -> None:
+        """Remove a member if ranked.
+
+        Args:
+            member: id of member to remove
+
+        """
+        key = self._keys.pop(member, None)
+        if key is not None:
+            del self._sorted[bisect.bisect_left(self._sorted, (key, member))]
+
+    def top(self, n: int) -> List[Tuple[_Key, int]]:
+        """Get (key, member) of the first n members.
+
+        Args:
+            n: how many to get
+
+        """
+        return self._sorted[:n]
+
+
+class Leaderboards:
+    """Rankings of users by land rate per trick, games won and improvement."""
+
+    def __init__(self,
+                 min_attempts: int = _DEFAULT_MIN_ATTEMPTS,
+                 improvement_window: int = _DEFAULT_IMPROVEMENT_WINDOW,
+                 id_block: int = _DEFAULT_ID_BLOCK) -> None:
+        """Initialize empty leaderboards, filled in by load.
+
+        Args:
+            min_attempts: fewest attempts at a trick to be ranked on it
+            improvement_window: compare land rate over a user's first this many
+                attempts with their latest this many
+            id_block: attempt ids are numbered in blocks of this size, one per
+                shard, 0 if in one sequence
+
+        """
+        self.min_attempts = min_attempts
+        self.improvement_window = improvement_window
+        self.id_block = id_block
+        # Highest attempt id included by load per id block, None until loaded
+        self.loaded_through: Optional[Dict[int, int]] = None
+        self._lock = threading.Lock()
+
+        self._trick_counts: Dict[Tuple[int, int], List[int]] = {}
+        self._trick_rankings: Dict[int, _Ranking[Tuple[float, int]]] = {}
+        self._user_attempts: Dict[int, int] = {}
+        self._first_lands: Dict[int, int] = {}
+        self._latest: Dict[int, Deque[bool]] = {}
+        self._latest_lands: Dict[int, int] = {}
+        self._improvement = _Ranking[float]()
+        self._wins: Dict[int, int] = {}
+        self._wins_ranking = _Ranking[int]()
+        self._games_counted: Set[int] = set()
+
+    def _add_attempt(self, user_id: int, trick_id: int, landed: bool) -> None:
+        """Count an attempt in the rankings, holding the lock."""
+        counts = self._trick_counts.setdefault((user_id, trick_id), [0, 0])
+        counts[0] += 1
+        counts[1] += landed
+        if counts[0] >= self.min_attempts:
+            self._trick_rankings.setdefault(trick_id, _Ranking()).set(
+                user_id, (-counts[1] / counts[0], -counts[0]))
+
+        n_attempts = self._user_attempts.get(user_id, 0) + 1
+        self._user_attempts[user_id] = n_attempts
+        if n_attempts <= self.improvement_window:
+            self._first_lands[user_id] = self._first_lands.get(user_id,
+                                                               0) + landed
+        latest = self._latest.setdefault(
+            user_id, collections.deque(maxlen=self.improvement_window))
+        if len(latest) == self.improvement_window:
+            self._latest_lands[user_id] -= latest[0]
+        latest.append(landed)
+        self._latest_lands[user_id] = self._latest_lands.get(user_id,
+                                                             0) + landed
+        # Rank once first and latest windows don't overlap
+        if n_attempts >= 2 * self.improvement_window:
+            self._improvement.set(
+                user_id,
+                (self._first_lands[user_id] - self._latest_lands[user_id]) /
+                self.improvement_window)
+
+    def _add_game_over(self, game_id: int, user_id: int,
+                       user_won: bool) -> None:
+        """Count a finished game once, holding the lock."""
+        if game_id in self._games_counted:
+            return
+        self._games_counted.add(game_id)
+        if user_won:
+            self._wins[user_id] = self._wins.get(user_id, 0) + 1
+            self._wins_ranking.set(user_id, -self._wins[user_id])
+
+    def load(self, attempts: Iterable[Tuple[int, int, int, bool]],
+             game_outcomes: Iterable[Tuple[int, int, bool]]) -> None:
+        """Fill in rankings from all data so far, unless already loaded.
+
+        Args:
+            attempts: (attempt id, user id, trick id, landed) of all attempts
+                not by past selves, in the order they happened
+            game_outcomes: (game id, user id, whether user won) of all finished
+                games
+
+        """
+        with self._lock:
+            if self.loaded_through is not None:
+                return
+            loaded_through: Dict[int, int] = {}
+            for attempt_id, user_id, trick_id, landed in attempts:
+                self._add_attempt(user_id, trick_id, landed)
+                block = self._block(attempt_id)
+                loaded_through[block] = max(loaded_through.get(block, 0),
+                                            attempt_id)
+            for game_id, user_id, user_won in game_outcomes:
+                self._add_game_over(game_id, user_id, user_won)
+            self.loaded_through = loaded_through
+
+    def _block(self, attempt_id: int) -> int:
+        """Get which id block an attempt id is in."""
+        return attempt_id // self.id_block if self.id_block else 0
+
+    def note_attempt(self, attempt_id: int, user_id: int, trick_id: int,
+                     landed: bool) -> None:
+        """Update rankings with a just recorded attempt, not by a past self.
+
+        Args:
+            attempt_id: id of the attempt, to skip those already loaded
+            user_id: id of the user attempting
+            trick_id: id of the trick attempted
+            landed: whether landed
+
+        """
+        with self._lock:
+            if self.loaded_through is not None and attempt_id > \
+                    self.loaded_through.get(self._block(attempt_id), 0):
+                self._add_attempt(user_id, trick_id, landed)
+
+    def note_game_over(self, game_id: int, user_id: int,
+                       user_won: bool) -> None:
+        """Update rankings with a just finished game.
+
+        Args:
+            game_id: id of the game, each game only counts once
+            user_id: id of the user playing their past self
+            user_won: whether the user won
+
+        """
+        with self._lock:
+            if self.loaded_through is not None:
+                self._add_game_over(game_id, user_id, user_won)
+
+    def top_by_trick(self, trick_id: int,
+                     n: int) -> List[Tuple[int, float, int]]:
+        """Get (user id, land rate, attempts) of the best n users at a trick.
+
+        Args:
+            trick_id: id of the trick
+            n: how many users to get
+
+        """
+        with self._lock:
+            ranking = self._trick_rankings.get(trick_id)
+            top = ranking.top(n) if ranking is not None else []
+        return [(user_id, -rate, -attempts) for (rate, attempts), user_id in top
+               ]
+
+    def top_by_wins(self, n: int) -> List[Tuple[int, int]]:
+        """Get (user id, games won) of the n users with most wins.
+
+        Args:
+            n: how many users to get
+
+        """
+        with self._lock:
+            top = self._wins_ranking.top(n)
+        return [(user_id, -wins) for wins, user_id in top]
+
+    def most_improved(self, n: int) -> List[Tuple[int, float]]:
+        """Get (user id, land rate increase) of the n most improved users.
+
+        Args:
+            n: how many users to get
+
+        """
+        with self._lock:
+            top = self._improvement.top(n)
+        return [(user_id, -improvement) for improvement, user_id in top]
+
+
+def init_leaderboards(app: Flask,
+                      min_attempts: int,
+                      improvement_window: int,
+                      id_block: int = _DEFAULT_ID_BLOCK) -> None:
+    """Give the app new leaderboards, loaded on first use.
+
+    Args:
+        app: the Flask web server application object
+        min_attempts: fewest attempts at a trick to be ranked on it
+        improvement_window: attempts in first and latest windows compared
+        id_block: size of the attempt id blocks, one per shard
+
+    """
+    app.extensions[_EXTENSION_KEY] = Leaderboards(min_attempts,
+                                                  improvement_window, id_block)
+
+
+def get_leaderboards(app: Flask) -> Leaderboards:
+    """Get the leaderboards of an app, making them if not set up yet.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    return app.extensions.setdefault(_EXTENSION_KEY, Leaderboards())
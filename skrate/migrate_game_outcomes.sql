@@ -0,0 +1,6 @@
+-- Outcome columns on game, set once a game finishes. Existing games are filled in afterwards by
+-- replaying them, the rules of SKATE live in game_logic.py
+ALTER TABLE game ADD COLUMN end_time TIMESTAMP WITHOUT TIME ZONE;
+ALTER TABLE game ADD COLUMN user_won BOOLEAN;
+ALTER TABLE game ADD COLUMN user_score INTEGER;
+ALTER TABLE game ADD COLUMN opponent_score INTEGER;
@@ -0,0 +1,47 @@
+-- Move user names stored as strings on attempt and game rows (past self attempts as past_<user>)
+-- into the integer-keyed "user" table. Quoting matters, user is a reserved word in Postgres - see
+-- https://dba.stackexchange.com/questions/75551/returning-rows-in-postgresql-with-a-table-called-user
+
+
+-- One user row per distinct name. A past self attempt is one in a game under some other name than
+-- the game's user, the name alone can't say (a real user may be called past_something)
+INSERT INTO "user" (name)
+SELECT attempt."user"
+FROM   attempt
+LEFT OUTER JOIN game
+             ON game.id = attempt.game_id
+WHERE  game.id IS NULL OR attempt."user" = game."user"
+UNION
+SELECT game."user" FROM game
+ON CONFLICT (name) DO NOTHING;
+
+-- Attempts get the user key plus a flag in place of the past_ prefix, past self rows owned by the game user
+ALTER TABLE attempt ADD COLUMN user_id INTEGER REFERENCES "user" (id);
+ALTER TABLE attempt ADD COLUMN is_past_self BOOLEAN NOT NULL DEFAULT FALSE;
+UPDATE attempt
+SET    user_id = "user".id
+FROM   "user"
+WHERE  "user".name = attempt."user";
+UPDATE attempt
+SET    user_id = "user".id,
+       is_past_self = TRUE
+FROM   game
+JOIN   "user"
+    ON "user".name = game."user"
+WHERE  game.id = attempt.game_id AND attempt."user" <> game."user";
+ALTER TABLE attempt ALTER COLUMN user_id SET NOT NULL;
+ALTER TABLE attempt ALTER COLUMN is_past_self DROP DEFAULT;
+ALTER TABLE attempt DROP COLUMN "user";
+
+-- Games only ever stored the real user name
+ALTER TABLE game ADD COLUMN user_id INTEGER REFERENCES "user" (id);
+UPDATE game
+SET    user_id = "user".id
+FROM   "user"
+WHERE  "user".name = game."user";
+ALTER TABLE game ALTER COLUMN user_id SET NOT NULL;
+ALTER TABLE game DROP COLUMN "user";
+
+-- Existing tables are skipped by create_all, so indexes on the models are made here
+CREATE INDEX ix_attempt_user_trick_time ON attempt (user_id, is_past_self, trick_id, time_of_attempt);
+CREATE INDEX ix_game_user_start ON game (user_id, start_time);
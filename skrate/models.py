@@ -1,20 +1,111 @@
-"""Models for key nouns in Skrate, namely tricks, attempts, games."""
+"""Models for key nouns in Skrate, namely users, tricks, attempts, games."""
+import contextlib
 import datetime
+import itertools
+import json
 import random
-from typing import Any, List, Mapping, Optional
+import threading
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
 
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from sqlalchemy import func, inspect, orm, select, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import joinedload
+from sqlalchemy.exc import IntegrityError
 # from sqlalchemy import text
 
+from skrate import attempt_buffer
+from skrate import fragment_cache
 from skrate import game_logic
+from skrate import idempotency
+from skrate import leaderboards
+from skrate import opponent_precompute
+from skrate import trick_search
+
+# Name of the optional read replica in SQLALCHEMY_BINDS app config
+REPLICA_BIND = "replica"
+
+# Per-thread flag for whether reads currently go to the replica
+_replica_routing = threading.local()
+
+# Name of each user shard in SQLALCHEMY_BINDS app config, by shard index
+SHARD_BIND_FORMAT = "shard_{}"
+
+# Each shard numbers its attempts and games from its own block of ids (the
+# primary database the first), so ids are unique across shards and rows can move
+# between them as they are
+SHARD_ID_BLOCK = 100000000
+
+# Most shards whose id blocks fit in integer id columns
+MAX_SHARDS = 20
+
+# Per-thread index of the shard queries currently go to, None for the primary
+_shard_routing = threading.local()
+
+
+class _RoutingSession(SignallingSession):
+    """Session sending queries to a user's shard inside user_shard, and reads
+    to the replica engine inside reading_from_replica.
+
+    Otherwise, and for flushes (inserts, updates) outside a shard, statements
+    go to the primary database. The replica only mirrors the primary.
+    """
+
+    def get_bind(self, mapper: Any = None, clause: Any = None) -> Any:
+        """Get engine for a statement, the shard or replica if routed there."""
+        shard = getattr(_shard_routing, "shard", None)
+        if shard is not None:
+            return get_state(self.app).db.get_engine(
+                self.app, bind=SHARD_BIND_FORMAT.format(shard))
+        binds = self.app.config.get("SQLALCHEMY_BINDS") or {}
+        if getattr(_replica_routing, "active", False) \
+                and REPLICA_BIND in binds and not self._flushing:
+            return get_state(self.app).db.get_engine(self.app,
+                                                     bind=REPLICA_BIND)
+        return super().get_bind(mapper, clause)
+
+
+class _RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy using the replica routing session above."""
+
+    def create_session(self, options: Mapping[str, Any]) -> orm.sessionmaker:
+        """Create the session factory, see SQLAlchemy.create_session."""
+        return orm.sessionmaker(class_=_RoutingSession, db=self, **options)
+
 
 # Our app database
-db = SQLAlchemy()
+db = _RoutingSQLAlchemy()
 
 # Game feed parameters
 _GAME_FEED_LENGTH = 4
 
+# Longest user and trick names the tables can store
+USER_NAME_MAX_LENGTH = 64
+TRICK_NAME_MAX_LENGTH = 64
+
+# Longest client request key, see RequestKey
+REQUEST_KEY_MAX_LENGTH = 64
+
+# Keep request keys in the database this long, for retries to find
+_REQUEST_KEY_LIFETIME = datetime.timedelta(days=1)
+
+# Key under app.extensions holding the trick registry for that app
+_TRICK_REGISTRY_KEY = "skrate_trick_registry"
+
+# Rows to fetch at a time when streaming whole tables
+_STREAM_BATCH_ROWS = 10000
+
+# Key under app.extensions caching the shard of each user, by user id
+_SHARD_DIRECTORY_KEY = "skrate_shard_directory"
+
+# Tables numbering rows from each shard's own block of ids
+_SHARD_ID_TABLES = ("attempt", "game")
+
+# Game record count each game's user_won value goes under
+_GAME_RECORD_KEYS = {True: "won", False: "lost", None: "unfinished"}
+
 
 def init_db_connec(app: Flask) -> None:
     """Connect to persistence layer for Skrate app.
@@ -26,15 +117,178 @@ def init_db_connec(app: Flask) -> None:
     db.init_app(app)
 
 
+@contextlib.contextmanager
+def reading_from_replica(enabled: bool = True) -> Iterator[None]:
+    """Within this context, send reads to read replica if one is configured.
+
+    Only use around read-only work that can tolerate replication lag. Without
+    a replica in SQLALCHEMY_BINDS, reads stay on the primary.
+
+    Args:
+        enabled: whether to use the replica, False leaves reads on primary
+
+    """
+    was_active = getattr(_replica_routing, "active", False)
+    _replica_routing.active = enabled
+    try:
+        yield
+    finally:
+        _replica_routing.active = was_active
+
+
+def shard_binds(shard_uris: Iterable[str]) -> Dict[str, str]:
+    """Get SQLALCHEMY_BINDS app config entries for user shards.
+
+    Args:
+        shard_uris: database URI of each shard, in shard index order
+
+    Raises:
+        ValueError: if more than MAX_SHARDS
+
+    """
+    binds = {
+        SHARD_BIND_FORMAT.format(shard): uri
+        for shard, uri in enumerate(shard_uris)
+    }
+    if len(binds) > MAX_SHARDS:
+        raise ValueError(f"At most {MAX_SHARDS} shards, got {len(binds)}.")
+    return binds
+
+
+def n_shards(app: Flask) -> int:
+    """Get how many user shards the app has, 0 if all data is on the primary.
+
+    Args:
+        app: The Flask web server application object
+
+    """
+    return len(app.config.get("SKRATE_SHARD_URIS") or ())
+
+
+def home_shard(user_name: str, shard_count: int) -> int:
+    """Get the shard a user's data belongs on, by a stable hash of their name.
+
+    Args:
+        user_name: the name of the user
+        shard_count: how many shards there are
+
+    """
+    return zlib.crc32(user_name.encode("utf-8")) % shard_count
+
+
+@contextlib.contextmanager
+def _routed_to_shard(shard: Optional[int]) -> Iterator[None]:
+    """Within this context, send all queries to a shard, None for the primary.
+
+    Args:
+        shard: index of the shard
+
+    """
+    was_shard = getattr(_shard_routing, "shard", None)
+    _shard_routing.shard = shard
+    try:
+        yield
+    finally:
+        _shard_routing.shard = was_shard
+
+
+def _each_location(app: Flask) -> Iterator[Optional[int]]:
+    """Route queries to the primary, then each shard in turn, yielding each.
+
+    Users not moved to a shard yet (see rebalance_shards) are on the primary.
+
+    Args:
+        app: The Flask web server application object
+
+    """
+    for shard in [None, *range(n_shards(app))]:
+        with _routed_to_shard(shard):
+            yield shard
+
+
+def _one_user_location(app: Flask, user_id: int) -> Iterator[None]:
+    """Route queries to the shard holding a user's data, yielding once.
+
+    Args:
+        app: The Flask web server application object
+        user_id: id of the user
+
+    """
+    with user_shard(app, user_id):
+        yield
+
+
+@contextlib.contextmanager
+def user_shard(app: Flask, user_id: int) -> Iterator[None]:
+    """Within this context, send queries to the shard holding a user's data.
+
+    Which shard is looked up in the user table on the primary once per user,
+    then kept in memory. Without shards, queries stay on the primary.
+
+    Args:
+        app: The Flask web server application object
+        user_id: id of the user
+
+    """
+    if not n_shards(app):
+        yield
+        return
+    with _routed_to_shard(_lookup_shard(app, user_id)):
+        yield
+
+
+def _lookup_shard(app: Flask, user_id: int) -> Optional[int]:
+    """Get the shard holding a user's data, None for the primary.
+
+    Args:
+        app: The Flask web server application object
+        user_id: id of the user
+
+    """
+    directory = app.extensions.setdefault(_SHARD_DIRECTORY_KEY, {})
+    if user_id not in directory:
+        with game_logic.app_context(app), _routed_to_shard(None):
+            directory[user_id] = db.session.query(
+                User.shard).filter(User.id == user_id).scalar()
+    return directory[user_id]
+
+
+def _shard_engines(app: Flask) -> List[Any]:
+    """Get the database engine of each shard, in shard index order.
+
+    Args:
+        app: The Flask web server application object
+
+    """
+    return [
+        db.get_engine(app, bind=SHARD_BIND_FORMAT.format(shard))
+        for shard in range(n_shards(app))
+    ]
+
+
 def create_db_tables(app: Flask) -> None:
     """Create or update table schemas based on models defined in this file.
 
+    Shards get all the tables too, numbering attempts and games from their own
+    block of ids.
+
     Args:
         app: The Flask web server application object
 
     """
     with app.app_context():
         db.create_all()
+        for shard, engine in enumerate(_shard_engines(app)):
+            db.Model.metadata.create_all(bind=engine)
+            block_start = (shard + 1) * SHARD_ID_BLOCK
+            with engine.begin() as conn:
+                # Rows moved in from other shards keep ids of other blocks
+                for table in _SHARD_ID_TABLES:
+                    conn.execute(
+                        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'),"
+                        f" greatest(%s, (SELECT max(id) FROM {table}"
+                        " WHERE id >= %s AND id < %s)))", block_start,
+                        block_start, block_start + SHARD_ID_BLOCK)
 
 
 def drop_db_tables(app: Flask) -> None:
@@ -47,27 +301,200 @@ def drop_db_tables(app: Flask) -> None:
         ValueError: if you try to run this on production config
 
     """
-    if not "test" in app.config["SQLALCHEMY_DATABASE_URI"]:
+    if not all("test" in uri
+               for uri in [app.config["SQLALCHEMY_DATABASE_URI"]] +
+               list(app.config.get("SKRATE_SHARD_URIS") or ())):
         raise ValueError("drop_all() only permitted on test db, use psql.")
     with app.app_context():
         db.drop_all()
+        for engine in _shard_engines(app):
+            db.Model.metadata.drop_all(bind=engine)
+    app.extensions.pop(_SHARD_DIRECTORY_KEY, None)
+
+
+def migrate_user_table(app: Flask) -> None:
+    """Convert legacy string user columns on attempt, game to user table keys.
+
+    Older Skrate databases stored the user name on every attempt and game row,
+    with past-self attempts as past_<user>. Safe to run repeatedly, does nothing
+    once migrated. Expects create_db_tables to have made the user table already.
+
+    Args:
+        app: The Flask web server application object
+
+    """
+    with app.app_context():
+        attempt_columns = [
+            column["name"]
+            for column in inspect(db.engine).get_columns("attempt")
+        ]
+        if "user" not in attempt_columns:
+            return
+
+        app.logger.info("Migrating attempt, game user names to user table...")
+        db.session.execute(game_logic._read_sql_resource("migrate_user_table"))
+        db.session.commit()
+
+
+def _replay_finished_games() -> Iterator[Mapping[str, Any]]:
+    """Stream outcome columns of finished games, worked out by replaying them."""
+    query = db.session.query(Attempt.game_id, Attempt.trick_id, Attempt.landed,
+                             Attempt.is_past_self, Attempt.time_of_attempt) \
+            .filter(Attempt.game_id.isnot(None)) \
+            .order_by(Attempt.game_id, Attempt.time_of_attempt, Attempt.id) \
+            .execution_options(stream_results=True) \
+            .yield_per(_STREAM_BATCH_ROWS)
+    for game_id, game_attempts in itertools.groupby(query,
+                                                    key=lambda row: row[0]):
+        game_state = game_logic.GameState("")
+        for _, trick_id, landed, is_past_self, time_of_attempt in game_attempts:
+            if game_state.apply_attempt(trick_id, "", landed, is_past_self):
+                yield _game_outcome(game_id, game_state, time_of_attempt)
+                break
+
+
+def migrate_game_outcomes(app: Flask) -> None:
+    """Add game outcome columns to older databases, filled in by game replays.
+
+    Safe to run repeatedly, does nothing once migrated.
+
+    Args:
+        app: The Flask web server application object
+
+    """
+    with app.app_context():
+        game_columns = [
+            column["name"] for column in inspect(db.engine).get_columns("game")
+        ]
+        if "end_time" in game_columns:
+            return
+
+        app.logger.info("Adding game outcome columns, replaying games...")
+        db.session.execute(
+            game_logic._read_sql_resource("migrate_game_outcomes"))
+        outcomes = list(_replay_finished_games())
+        db.session.bulk_update_mappings(Game, outcomes)
+        db.session.commit()
+        app.logger.info("Stored outcomes of %s finished games.", len(outcomes))
+
+
+def migrate_game_as_of(app: Flask) -> None:
+    """Add the as-of time column to game tables of older databases.
+
+    Safe to run repeatedly, does nothing once migrated.
+
+    Args:
+        app: The Flask web server application object
+
+    """
+    with app.app_context():
+        game_columns = [
+            column["name"] for column in inspect(db.engine).get_columns("game")
+        ]
+        if "as_of" in game_columns:
+            return
+
+        app.logger.info("Adding game as-of column...")
+        db.session.execute("ALTER TABLE game ADD COLUMN as_of TIMESTAMP")
+        db.session.commit()
+
+
+def migrate_user_shard(app: Flask) -> None:
+    """Add the shard column to user tables of older databases.
+
+    Safe to run repeatedly, does nothing once migrated.
+
+    Args:
+        app: The Flask web server application object
+
+    """
+    with app.app_context():
+        user_columns = [
+            column["name"] for column in inspect(db.engine).get_columns("user")
+        ]
+        if "shard" in user_columns:
+            return
+
+        app.logger.info("Adding user shard column...")
+        db.session.execute('ALTER TABLE "user" ADD COLUMN shard INTEGER')
+        db.session.commit()
+
+
+def migrate_trick_owner(app: Flask) -> None:
+    """Add the owner column to trick tables of older databases, and shards.
+
+    Trick names become unique per owner rather than overall. Safe to run
+    repeatedly, does nothing once migrated.
+
+    Args:
+        app: The Flask web server application object
+
+    """
+    with app.app_context():
+        for engine in [db.engine] + _shard_engines(app):
+            trick_columns = [
+                column["name"]
+                for column in inspect(engine).get_columns("trick")
+            ]
+            if "owner_id" in trick_columns:
+                continue
+
+            app.logger.info("Adding trick owner column...")
+            with engine.begin() as conn:
+                conn.execute("ALTER TABLE trick ADD COLUMN owner_id INTEGER")
+                conn.execute(
+                    "ALTER TABLE trick DROP CONSTRAINT IF EXISTS trick_name_key"
+                )
+                conn.execute(
+                    "CREATE INDEX ix_trick_owner_id ON trick (owner_id)")
+                conn.execute("CREATE UNIQUE INDEX ix_trick_owner_name ON trick "
+                             "(coalesce(owner_id, 0), name)")
+
+
+class User(db.Model):  # type: ignore
+    """A skater using Skrate, referenced by id from attempts and games."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(USER_NAME_MAX_LENGTH),
+                     unique=True,
+                     nullable=False)
+    # Shard holding the user's attempts and games, NULL for the primary
+    shard = db.Column(db.Integer)
+    attempts = db.relationship("Attempt", backref="user", lazy=True)
+    games = db.relationship("Game", backref="user", lazy=True)
 
 
 class Trick(db.Model):  # type: ignore
-    """A type of trick (i.e., kickflip) - **NOT** a specific attempt of one."""
+    """A type of trick (i.e., kickflip) - **NOT** a specific attempt of one.
+
+    Tricks with an owner are that user's custom tricks, only they see them.
+    """
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(64), unique=True, nullable=False)
+    name = db.Column(db.String(TRICK_NAME_MAX_LENGTH), nullable=False)
+    # User id, not a foreign key as the catalog is copied to every shard
+    owner_id = db.Column(db.Integer, index=True)
     attempts = db.relationship("Attempt", backref="trick", lazy=True)
 
 
+# Names are unique among shared tricks, and among each user's own
+db.Index("ix_trick_owner_name",
+         func.coalesce(Trick.owner_id, 0),
+         Trick.name,
+         unique=True)
+
+
 class Attempt(db.Model):  # type: ignore
     """An attempt at a trick, with landed or not result."""
 
+    __table_args__ = (db.Index("ix_attempt_user_trick_time", "user_id",
+                               "is_past_self", "trick_id", "time_of_attempt"),)
+
     id = db.Column(db.Integer, primary_key=True)
     trick_id = db.Column(db.Integer, db.ForeignKey("trick.id"), nullable=False)
     game_id = db.Column(db.Integer, db.ForeignKey("game.id"))
-    user = db.Column(db.String(16), nullable=False)  # Note can be past_<user>
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    is_past_self = db.Column(db.Boolean, nullable=False, default=False)
     landed = db.Column(db.Boolean, nullable=False)
     time_of_attempt = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
@@ -75,127 +502,1055 @@ class Attempt(db.Model):  # type: ignore
 class Game(db.Model):  # type: ignore
     """A single game of SKATE against your past self."""
 
+    __table_args__ = (db.Index("ix_game_user_start", "user_id", "start_time"),)
+
     id = db.Column(db.Integer, primary_key=True)
-    attempts = db.relationship("Attempt", backref="game", lazy=True)
-    user = db.Column(db.String(16), nullable=False)
+    attempts = db.relationship("Attempt",
+                               backref="game",
+                               lazy="selectin",
+                               order_by="(Attempt.time_of_attempt, Attempt.id)")
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     start_time = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # Past self plays as the user was at this time, NULL for as of now
+    as_of = db.Column(db.DateTime)
+    # Outcome, set once when the game finishes, all NULL until then
+    end_time = db.Column(db.DateTime)
+    user_won = db.Column(db.Boolean)
+    user_score = db.Column(db.Integer)
+    opponent_score = db.Column(db.Integer)
+
+
+class RequestKey(db.Model):  # type: ignore
+    """Client key of a write request already done, with the response sent.
+
+    Written in the same transaction as the request's writes, on the user's
+    shard, so a retry with the same key finds it and writes nothing.
+    """
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    key = db.Column(db.String(REQUEST_KEY_MAX_LENGTH), primary_key=True)
+    # JSON of the response to the request
+    response = db.Column(db.Text, nullable=False)
+    time_of_request = db.Column(db.DateTime,
+                                default=datetime.datetime.utcnow,
+                                nullable=False)
+
+
+class TrickRegistry(Mapping[int, str]):
+    """In-memory lookup of trick name by id, loaded from trick table.
+
+    Loaded on first use and refreshed when the trick catalog changes, so game
+    replays and views don't need to load Trick rows. Looking up an id not seen
+    yet reloads, in case another process added tricks. Holds every user's
+    custom tricks too, see visible_to.
+    """
+
+    def __init__(self, app: Flask) -> None:
+        """Initialize a registry, not loaded until first lookup.
+
+        Args:
+            app: the Flask web server application object
+
+        """
+        self._app = app
+        self._names: Optional[Dict[int, str]] = None
+        self._owners: Dict[int, Optional[int]] = {}
+        self._search_index: Optional[trick_search.TrickSearchIndex] = None
+        # Moves on with every reload, e.g. for views listing tricks
+        self.version = 0
+
+    def refresh(self) -> None:
+        """Reload trick ids, names and owners from the trick table."""
+        with game_logic.app_context(self._app):
+            rows = db.session.query(Trick.id, Trick.name, Trick.owner_id).all()
+        # Swap in whole new dicts, so concurrent readers see old or new
+        rows.sort()
+        self._owners = {trick_id: owner_id for trick_id, _, owner_id in rows}
+        self._names = {trick_id: name for trick_id, name, _ in rows}
+        self._search_index = None
+        self.version += 1
+
+    def visible_to(self, user_id: Optional[int]) -> List[int]:
+        """Get ids of shared tricks and a user's own, in id order.
+
+        Args:
+            user_id: id of the user, None for shared tricks only
+
+        """
+        names = self._loaded_names()
+        return [
+            trick_id for trick_id in names
+            if self._owners.get(trick_id) in (None, user_id)
+        ]
+
+    def owner(self, trick_id: int) -> Optional[int]:
+        """Get id of the user whose custom trick this is, None if shared.
+
+        Args:
+            trick_id: id of the trick
+
+        Raises:
+            KeyError: if there is no trick with that id
+
+        """
+        self[trick_id]  # reload if not seen yet
+        return self._owners[trick_id]
+
+    def search_index(self) -> trick_search.TrickSearchIndex:
+        """Get the name search index, built on first use after each reload."""
+        index = self._search_index
+        if index is None:
+            names, owners = self._loaded_names(), self._owners
+            version = self.version
+            index = trick_search.TrickSearchIndex(
+                (trick_id, name, owners.get(trick_id))
+                for trick_id, name in names.items())
+            if self.version == version:  # else reloaded meanwhile, rebuild
+                self._search_index = index
+        return index
+
+    def _loaded_names(self) -> Dict[int, str]:
+        """Get the id to name dict, loading it if not yet."""
+        if self._names is None:
+            self.refresh()
+        return self._names  # type: ignore
+
+    def __getitem__(self, trick_id: int) -> str:
+        """Get name of a trick by id.
+
+        Args:
+            trick_id: id of the trick
+
+        Raises:
+            KeyError: if there is no trick with that id
+
+        """
+        if trick_id not in self._loaded_names():
+            self.refresh()
+        return self._loaded_names()[trick_id]
+
+    def __iter__(self) -> Iterator[int]:
+        """Iterate over trick ids."""
+        return iter(self._loaded_names())
+
+    def __len__(self) -> int:
+        """Get number of tricks."""
+        return len(self._loaded_names())
+
+
+def get_trick_registry(app: Flask) -> TrickRegistry:
+    """Get the trick registry of an app, making one if not set up yet.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    return app.extensions.setdefault(_TRICK_REGISTRY_KEY, TrickRegistry(app))
+
+
+def _load_game(game_id: Optional[int],
+               user_id: Optional[int] = None) -> Optional[Game]:
+    """Load a game with its user and ordered attempts in a single query.
 
+    Args:
+        game_id: id of the game
+        user_id: id of user the game must belong to, if checking
+
+    """
+    query = Game.query.options(joinedload(Game.user),
+                               joinedload(Game.attempts)) \
+            .filter(Game.id == game_id)
+    if user_id is not None:
+        query = query.filter(Game.user_id == user_id)
+    return query.one_or_none()
+
+
+def get_user_id(app: Flask, user_name: str) -> int:
+    """Look up id of user by name, adding them to the user table if new.
+
+    With shards, new users are put on their home shard, see home_shard.
+
+    Args:
+        app: The Flask web server application object
+        user_name: the name the user logged in as
+
+    """
+    with app.app_context():
+        user = User.query.filter_by(name=user_name).one_or_none()
+        if user is None:
+            shard_count = n_shards(app)
+            try:
+                user = User(name=user_name,
+                            shard=home_shard(user_name, shard_count)
+                            if shard_count else None)
+                db.session.add(user)
+                db.session.commit()
+                app.logger.info("Added new user %s with id %s", user_name,
+                                user.id)
+            except IntegrityError:
+                # Another request added this new user just before us, use theirs
+                db.session.rollback()
+                user = User.query.filter_by(name=user_name).one()
+            if user.shard is not None:
+                _copy_user_to_shard(user.id, user.name, user.shard)
+        return user.id
+
+
+def _copy_user_to_shard(user_id: int, user_name: str, shard: int) -> None:
+    """Add a user's row to their shard, for its attempts and games to refer to.
+
+    Args:
+        user_id: id of the user
+        user_name: name of the user
+        shard: index of the user's shard
 
-def record_attempt(app: Flask, user: str, trick_id: int, landed: bool,
-                   game_id: Optional[int]) -> None:
+    """
+    with _routed_to_shard(shard):
+        db.session.execute(
+            postgresql.insert(
+                User.__table__).values(id=user_id, name=user_name,
+                                       shard=shard).on_conflict_do_nothing())
+        db.session.commit()
+
+
+def replicate_tricks(app: Flask,
+                     trick_ids: Optional[Iterable[int]] = None) -> None:
+    """Copy the trick catalog from the primary to every shard, keeping ids.
+
+    Args:
+        app: The Flask web server application object
+        trick_ids: ids of the tricks to copy, None for all
+
+    """
+    if not n_shards(app):
+        return
+    with app.app_context():
+        query = db.session.query(Trick.id, Trick.name, Trick.owner_id)
+        if trick_ids is not None:
+            query = query.filter(Trick.id.in_(list(trick_ids)))
+        rows = [{
+            "id": trick_id,
+            "name": name,
+            "owner_id": owner_id
+        } for trick_id, name, owner_id in query]
+        if not rows:
+            return
+        insert = postgresql.insert(Trick.__table__).values(rows)
+        upsert = insert.on_conflict_do_update(
+            index_elements=[Trick.id],
+            set_={
+                "name": insert.excluded.name,
+                "owner_id": insert.excluded.owner_id
+            })
+        for shard in range(n_shards(app)):
+            with _routed_to_shard(shard):
+                db.session.execute(upsert)
+                db.session.commit()
+
+
+def _move_user(user_id: int, user_name: str, source: Optional[int],
+               target: int) -> None:
+    """Move a user's games and attempts to another shard, keeping their ids.
+
+    Copies, then points the user table at the new shard, then deletes the
+    originals, so a move cut short can be run again.
+
+    Args:
+        user_id: id of the user
+        user_name: name of the user
+        source: index of the shard the data is on, None for the primary
+        target: index of the shard to move to
+
+    """
+    _copy_user_to_shard(user_id, user_name, target)
+    with _routed_to_shard(target):
+        # Leftovers of a move cut short before the user table was updated
+        Attempt.query.filter(Attempt.user_id == user_id).delete()
+        Game.query.filter(Game.user_id == user_id).delete()
+
+    # Games first, attempts refer to them
+    for table in (Game.__table__, Attempt.__table__):
+        last_id = 0
+        while True:
+            with _routed_to_shard(source):
+                rows = db.session.execute(
+                    select([table]).where(table.c.user_id == user_id).where(
+                        table.c.id > last_id).order_by(
+                            table.c.id).limit(_STREAM_BATCH_ROWS)).fetchall()
+            if not rows:
+                break
+            with _routed_to_shard(target):
+                db.session.execute(table.insert(), [dict(row) for row in rows])
+            last_id = rows[-1].id
+    db.session.commit()
+
+    with _routed_to_shard(None):
+        User.query.filter(User.id == user_id).update({"shard": target})
+        db.session.commit()
+
+    with _routed_to_shard(source):
+        Attempt.query.filter(Attempt.user_id == user_id).delete()
+        Game.query.filter(Game.user_id == user_id).delete()
+        # Not moved, keys only matter for retries in the next few seconds
+        RequestKey.query.filter(RequestKey.user_id == user_id).delete()
+        if source is not None:
+            User.query.filter(User.id == user_id).delete()
+        db.session.commit()
+
+
+def rebalance_shards(app: Flask) -> int:
+    """Move each user whose data isn't on their home shard there.
+
+    E.g. after adding shards, or to spread users from before sharding (on the
+    primary) over the shards. Run with no server using the database, servers
+    keep each user's shard in memory.
+
+    Args:
+        app: The Flask web server application object
+
+    Returns:
+        Number of users moved
+
+    Raises:
+        ValueError: if no shards are configured, or a user is on a shard no
+            longer configured
+
+    """
+    shard_count = n_shards(app)
+    if not shard_count:
+        raise ValueError("No shards configured, see SKRATE_SHARD_URIS.")
+    moved = 0
+    with app.app_context():
+        users = db.session.query(User.id, User.name,
+                                 User.shard).order_by(User.id).all()
+        for user_id, user_name, shard in users:
+            target = home_shard(user_name, shard_count)
+            if shard == target:
+                continue
+            if shard is not None and shard >= shard_count:
+                raise ValueError(f"User {user_name} is on shard {shard}, "
+                                 "keep its URI configured until moved.")
+            _move_user(user_id, user_name, shard, target)
+            app.logger.info("Moved user %s from shard %s to %s", user_name,
+                            shard, target)
+            moved += 1
+    app.extensions.pop(_SHARD_DIRECTORY_KEY, None)
+    return moved
+
+
+def lookup_user_id(app: Flask, user_name: str) -> Optional[int]:
+    """Look up id of user by name, None if no such user.
+
+    Args:
+        app: The Flask web server application object
+        user_name: the name of the user
+
+    """
+    with app.app_context():
+        return db.session.query(User.id).filter_by(name=user_name).scalar()
+
+
+class OutOfTurnError(RuntimeError):
+    """An attempt in a game when it isn't the user's turn, or it's over."""
+
+
+class RequestReplayError(RuntimeError):
+    """A write request retried with a key already done, nothing was written."""
+
+    def __init__(self, response: idempotency.Response) -> None:
+        """Initialize with the response to send back again.
+
+        Args:
+            response: the response sent to the request the first time
+
+        """
+        super().__init__("Request already done.")
+        self.response = response
+
+
+def _check_request_key(app: Flask, user_id: int,
+                       request_key: Optional[str]) -> None:
+    """Refuse a request whose key is in the in-memory store, done already.
+
+    Args:
+        app: The Flask web server application object
+        user_id: id of the user making the request
+        request_key: the client's key for the request, if any
+
+    Raises:
+        RequestReplayError: if the request was done already
+
+    """
+    if request_key is None:
+        return
+    response = idempotency.get_idempotency_store(app).get(user_id, request_key)
+    if response is not None:
+        raise RequestReplayError(response)
+
+
+def _delete_expired_request_keys(user_ids: Iterable[int]) -> None:
+    """Delete users' request keys older than _REQUEST_KEY_LIFETIME.
+
+    Args:
+        user_ids: ids of the users
+
+    """
+    expired = datetime.datetime.utcnow() - _REQUEST_KEY_LIFETIME
+    RequestKey.query.filter(RequestKey.user_id.in_(list(user_ids)),
+                            RequestKey.time_of_request
+                            < expired).delete(synchronize_session=False)
+
+
+def _claim_request_key(app: Flask, user_id: int, request_key: Optional[str],
+                       response: idempotency.Response) -> None:
+    """Store a request's key and response in the transaction doing its writes.
+
+    If another transaction holds the key uncommitted, e.g. a retry while the
+    first try is still running, this waits for it. Also deletes the user's
+    keys older than _REQUEST_KEY_LIFETIME. Call in the user's shard context.
+
+    Args:
+        app: The Flask web server application object
+        user_id: id of the user making the request
+        request_key: the client's key for the request, if any
+        response: what the request will send back
+
+    Raises:
+        RequestReplayError: if the request was done already, after rolling
+            back the transaction
+
+    """
+    if request_key is None:
+        return
+    _delete_expired_request_keys([user_id])
+    claimed = db.session.execute(
+        postgresql.insert(RequestKey.__table__).values(
+            user_id=user_id, key=request_key,
+            response=json.dumps(response)).on_conflict_do_nothing().returning(
+                RequestKey.key)).scalar()
+    if claimed is None:
+        earlier = json.loads(
+            db.session.query(RequestKey.response).filter(
+                RequestKey.user_id == user_id,
+                RequestKey.key == request_key).scalar())
+        db.session.rollback()
+        idempotency.get_idempotency_store(app).put(user_id, request_key,
+                                                   earlier)
+        raise RequestReplayError(earlier)
+
+
+def _note_attempt(app: Flask, attempt: Attempt) -> None:
+    """Update in-memory caches and rankings with a just committed attempt.
+
+    Args:
+        app: The Flask web server application object
+        attempt: the attempt, committed
+
+    """
+    app.logger.info("Committed new attempt with id %s", attempt.id)
+    fragment_cache.get_fragment_cache(app).note_attempt(attempt.user_id,
+                                                        attempt.game_id)
+    if not attempt.is_past_self:
+        leaderboards.get_leaderboards(app).note_attempt(attempt.id,
+                                                        attempt.user_id,
+                                                        attempt.trick_id,
+                                                        attempt.landed)
+
+
+def record_attempt(app: Flask,
+                   user_id: int,
+                   trick_id: int,
+                   landed: bool,
+                   game_id: Optional[int],
+                   is_past_self: bool = False,
+                   request_key: Optional[str] = None,
+                   response: Optional[idempotency.Response] = None) -> None:
     """Record an attempt by user (or fake attempt as part of a game)
 
+    Attempts in games should go through play_game_turn instead, to take turns.
+    With write-behind on (see attempt_buffer), practice attempts are buffered
+    and written in batches by write_buffered_attempts.
+
     Args:
         app: The Flask web server application object
-        user: the user attempting the trick (may be past_someone)
+        user_id: id of the user attempting the trick
         trick_id: id of the trick being attempted
         landed: whether or not it was landed successfully
         game_id: id of which game it's part of, if any
+        is_past_self: whether this is a fake attempt by the past self in a game
+        request_key: the client's key for the request, if any, to record the
+            attempt only once however often the request is retried
+        response: what the request will send back, kept under request_key
+
+    Raises:
+        RequestReplayError: if the request_key was done already
 
     """
-    with app.app_context():
+    store = idempotency.get_idempotency_store(app)
+    buffer = attempt_buffer.get_attempt_buffer(app)
+    if buffer is not None and game_id is None and not is_past_self:
+        if request_key is not None:
+            earlier = store.put_if_absent(user_id, request_key, response)
+            if earlier is not None:
+                raise RequestReplayError(earlier)
+        buffer.add(user_id, trick_id, landed, request_key,
+                   json.dumps(response) if request_key is not None else None)
+        fragment_cache.get_fragment_cache(app).note_attempt(user_id, None)
+        return
+
+    _check_request_key(app, user_id, request_key)
+    with app.app_context(), user_shard(app, user_id):
+        _claim_request_key(app, user_id, request_key, response)
         att = Attempt(trick_id=trick_id,
                       game_id=game_id,
-                      user=user,
+                      user_id=user_id,
+                      is_past_self=is_past_self,
                       landed=landed)
         db.session.add(att)
         db.session.commit()
-        app.logger.info("Committed new attempt with id %s", att.id)
+        if request_key is not None:
+            store.put(user_id, request_key, response)
+        _note_attempt(app, att)
+
 
+def write_buffered_attempts(
+        app: Flask, batch: List[attempt_buffer.BufferedAttempt]) -> None:
+    """Insert a batch of buffered practice attempts, one commit per location.
 
-def opponent_response_if_any(app: Flask, user: str,
-                             game_id_if_any: Optional[int]) -> bool:
-    """If in an ongoing game (not completed), past self needs to respond.
+    Attempts whose request key is in the database already, i.e. retries of
+    requests another process did, are dropped. Expired keys of the batch's
+    users are deleted.
+
+    Args:
+        app: The Flask web server application object
+        batch: the attempts, in the order buffered
+
+    """
+    by_location: Dict[Optional[int], List[attempt_buffer.BufferedAttempt]] = {}
+    for attempt in batch:
+        location = _lookup_shard(app,
+                                 attempt.user_id) if n_shards(app) else None
+        by_location.setdefault(location, []).append(attempt)
+
+    inserted = []
+    with app.app_context():
+        for location, attempts in by_location.items():
+            with _routed_to_shard(location):
+                keys = [{
+                    "user_id": attempt.user_id,
+                    "key": attempt.request_key,
+                    "response": attempt.response,
+                    "time_of_request": attempt.time_of_attempt
+                } for attempt in attempts if attempt.request_key is not None]
+                claimed = set()
+                if keys:
+                    _delete_expired_request_keys(
+                        {key["user_id"] for key in keys})
+                    claimed = {
+                        tuple(row) for row in db.session.execute(
+                            postgresql.insert(RequestKey.__table__).values(
+                                keys).on_conflict_do_nothing().returning(
+                                    RequestKey.user_id, RequestKey.key))
+                    }
+                rows = [{
+                    "user_id": attempt.user_id,
+                    "trick_id": attempt.trick_id,
+                    "landed": attempt.landed,
+                    "time_of_attempt": attempt.time_of_attempt,
+                    "game_id": None,
+                    "is_past_self": False
+                } for attempt in attempts if attempt.request_key is None or
+                        (attempt.user_id, attempt.request_key) in claimed]
+                if not rows:
+                    continue
+                inserted += db.session.execute(
+                    Attempt.__table__.insert().values(rows).returning(
+                        Attempt.id, Attempt.user_id, Attempt.trick_id,
+                        Attempt.landed)).fetchall()
+        with attempt_buffer.get_attempt_buffer(app).committing():
+            db.session.commit()
+    app.logger.info("Committed %s buffered attempts", len(inserted))
+
+    boards = leaderboards.get_leaderboards(app)
+    for attempt_id, user_id, trick_id, landed in sorted(inserted):
+        boards.note_attempt(attempt_id, user_id, trick_id, landed)
+
+
+def prepare_opponent_rates(
+        app: Flask, user_id: int,
+        game_id: int) -> Optional[opponent_precompute.PreparedRates]:
+    """Read the land rates past self plays a game's next turn with, ahead of it.
 
     Args:
         app: the Flask web server application object
-        user: the name of the current user (not past_ self)
-        game_id_if_any: integer game id if we're in one
+        user_id: id of the game's user
+        game_id: id of the game
 
     Returns:
-        Whether or not the game is ongoing
+        The rates, None if the game is over
 
     """
-    if game_id_if_any is None:
-        return False
+    # Read first, so attempts committed meanwhile make the rates stale
+    stats_version = fragment_cache.get_fragment_cache(app).stats_version(
+        user_id)
+    with app.app_context(), user_shard(app, user_id):
+        game = db.session.query(Game.as_of, Game.end_time).filter(
+            Game.id == game_id, Game.user_id == user_id).one_or_none()
+        if game is None or game.end_time is not None:
+            return None
+        n_attempts = Attempt.query.filter(Attempt.game_id == game_id).count()
+        rates = game_logic.get_odds_lookup_dict(app, user_id, db, game.as_of)
+        # Attempts now are after as_of, so don't move an as_of game's rates
+        rates_if_attempted = None if game.as_of else \
+                game_logic.get_odds_lookup_dict(app, user_id, db, None, 0)
+    return opponent_precompute.PreparedRates(game_id, n_attempts, stats_version,
+                                             rates, rates_if_attempted)
+
+
+def _schedule_prepared_rates(app: Flask, user_id: int, game_id: int) -> None:
+    """Prepare past self's rates for a game's next turn, if precomputing.
 
-    with app.app_context():
-        game = Game.query.filter_by(id=game_id_if_any).one()
-        game_state = get_game_state(game.attempts, user)
+    Args:
+        app: the Flask web server application object
+        user_id: id of the game's user
+        game_id: id of the game
+
+    """
+    precompute = opponent_precompute.get_opponent_precompute(app)
+    if precompute is not None:
+        precompute.schedule(user_id, game_id)
+
+
+def _take_prepared_rates(
+        app: Flask, user_id: int, game_id: int,
+        n_attempts: int) -> Optional[opponent_precompute.PreparedRates]:
+    """Get rates prepared for a game's turn, None if none or stale.
+
+    Args:
+        app: the Flask web server application object
+        user_id: id of the game's user
+        game_id: id of the game
+        n_attempts: attempts in the game before the turn
+
+    """
+    precompute = opponent_precompute.get_opponent_precompute(app)
+    prepared = precompute and precompute.take(game_id)
+    if not prepared or not prepared.is_current(
+            n_attempts,
+            fragment_cache.get_fragment_cache(app).stats_version(user_id)):
+        return None
+    return prepared
+
+
+def _game_outcome(game_id: int, game_state: game_logic.GameState,
+                  end_time: datetime.datetime) -> Mapping[str, Any]:
+    """Get outcome column values of a finished game.
+
+    Args:
+        game_id: id of the game
+        game_state: state of the game after its last attempt
+        end_time: when the game finished
+
+    """
+    return {
+        "id": game_id,
+        "end_time": end_time,
+        "user_won": game_state.opponent_score >= len(game_logic.LETTERS),
+        "user_score": game_state.user_score,
+        "opponent_score": game_state.opponent_score
+    }
+
+
+def play_game_turn(
+        app: Flask,
+        user_id: int,
+        trick_id: int,
+        landed: bool,
+        game_id: int,
+        request_key: Optional[str] = None,
+        response: Optional[idempotency.Response] = None
+) -> game_logic.GameState:
+    """Record a user's attempt in a game, and past self's response if any.
+
+    The game row is locked (SELECT ... FOR UPDATE) for the turn, so concurrent
+    attempts at one game, from any worker process, take turns one at a time.
+    The user's attempt, past self's response and the game outcome if it ended
+    are committed together, so a game is never left mid-turn.
+    Past self's response uses rates read ahead of the turn if the opponent
+    precompute has them ready and current, else reads them.
+
+    Args:
+        app: the Flask web server application object
+        user_id: id of the current user (not past self)
+        trick_id: id of the trick the user attempted
+        landed: whether the user landed it
+        game_id: id of the game, must be the user's
+        request_key: the client's key for the request, if any, to play the
+            turn only once however often the request is retried
+        response: what the request will send back, kept under request_key
+
+    Returns:
+        State of the game after the turn, e.g. for whether it's ongoing, or
+        for game_view_params
+
+    Raises:
+        OutOfTurnError: if the game is over, or another user's
+        RequestReplayError: if the request_key was done already
+
+    """
+    _check_request_key(app, user_id, request_key)
+    with app.app_context(), user_shard(app, user_id):
+        # Before the turn checks, a retry of the game's last turn is no error
+        _claim_request_key(app, user_id, request_key, response)
+        locked = db.session.query(Game.id) \
+                .filter(Game.id == game_id, Game.user_id == user_id,
+                        Game.end_time.is_(None)) \
+                .with_for_update().scalar()
+        if locked is None:
+            db.session.rollback()
+            raise OutOfTurnError(f"Game {game_id} is over or not the user's.")
+        trick_names = get_trick_registry(app)
+        game = _load_game(game_id)
+        game_state = get_game_state(game.attempts, game.user.name, trick_names)
+        prepared = _take_prepared_rates(app, user_id, game_id,
+                                        len(game.attempts))
+
+        new_attempts = [
+            Attempt(trick_id=trick_id,
+                    game_id=game_id,
+                    user_id=user_id,
+                    is_past_self=False,
+                    landed=landed)
+        ]
+        db.session.add(new_attempts[0])
+        game_state.apply_attempt(trick_id, trick_names[trick_id], landed, False)
+        if game_state.is_ongoing():
+            # Past self to choose a trick - if on a challenge, must be same,
+            # else their best trick next
+            trick_to_try = game_state.challenging_move_id
+            if prepared is not None:
+                if trick_to_try is None:
+                    trick_to_try = game_logic.choose_trick(
+                        prepared.trick_ids_by_rate(trick_id),
+                        game_state.trick_ids_used_up)
+                odds = prepared.odds(trick_to_try, trick_id)
+            else:
+                db.session.flush()
+                if trick_to_try is None:
+                    trick_to_try = game_logic.game_trick_choice(
+                        app, user_id, game_state.trick_ids_used_up, db,
+                        game.as_of)
+                odds = game_logic.get_odds(app, user_id, trick_to_try, db,
+                                           game.as_of)
+
+            # Figure whether past self lands
+            land = random.uniform(0, 1) <= odds
+            new_attempts.append(
+                Attempt(trick_id=trick_to_try,
+                        game_id=game_id,
+                        user_id=user_id,
+                        is_past_self=True,
+                        landed=land))
+            db.session.add(new_attempts[1])
+            game_state.apply_attempt(trick_to_try, trick_names[trick_to_try],
+                                     land, True)
+
+        outcome = None
         if not game_state.is_ongoing():
-            return False
+            outcome = _game_outcome(game_id, game_state,
+                                    datetime.datetime.utcnow())
+            Game.query.filter(Game.id == game_id) \
+                    .update(outcome, synchronize_session=False)
+        db.session.commit()
 
-        # Opponent to choose a trick - if on a challenge, must be same
-        trick_to_try = game_state.challenging_move_id
-        if trick_to_try is None:
-            # If not on a challenge, logic is do user's best trick next
-            trick_to_try = game_logic.game_trick_choice(
-                app, user, game_state.trick_ids_used_up, db)
+        if request_key is not None:
+            idempotency.get_idempotency_store(app).put(user_id, request_key,
+                                                       response)
+        for attempt in new_attempts:
+            _note_attempt(app, attempt)
+        if outcome is not None:
+            leaderboards.get_leaderboards(app).note_game_over(
+                game_id, user_id, outcome["user_won"])
+        else:
+            _schedule_prepared_rates(app, user_id, game_id)
+        return game_state
 
-        # Figure whether opponent lands
-        odds = game_logic.get_odds(app, user, trick_to_try, db)
-        land = random.uniform(0, 1) <= odds
-        record_attempt(app, "past_" + user, trick_to_try, land, game_id_if_any)
 
-        # Refresh game with any opponent attempt above, and see if game is finished
-        game_updated = Game.query.filter_by(id=game_id_if_any).one()
-        game_state_updated = get_game_state(game_updated.attempts, user)
-        return game_state_updated.is_ongoing()
+def _stream_attempts_by_users(
+        app: Flask) -> Iterator[Tuple[int, int, int, bool]]:
+    """Stream (id, user id, trick id, landed) of attempts not by past selves.
 
+    Each user's attempts come in the order they happened, from the primary
+    then each shard.
+    """
+    for _ in _each_location(app):
+        query = db.session.query(Attempt.id, Attempt.user_id, Attempt.trick_id,
+                                 Attempt.landed) \
+                .filter(Attempt.is_past_self.is_(False)) \
+                .order_by(Attempt.time_of_attempt, Attempt.id) \
+                .execution_options(stream_results=True) \
+                .yield_per(_STREAM_BATCH_ROWS)
+        for row in query:
+            yield tuple(row)
+
+
+def _stream_game_outcomes(app: Flask) -> Iterator[Tuple[int, int, bool]]:
+    """Stream (game id, user id, whether user won) of finished games."""
+    for _ in _each_location(app):
+        query = db.session.query(Game.id, Game.user_id, Game.user_won) \
+                .filter(Game.end_time.isnot(None)) \
+                .execution_options(stream_results=True) \
+                .yield_per(_STREAM_BATCH_ROWS)
+        for row in query:
+            yield tuple(row)
+
+
+def get_loaded_leaderboards(app: Flask) -> leaderboards.Leaderboards:
+    """Get the app's leaderboards, loading them by scanning data on first use.
 
-def start_game(app: Flask, user: str) -> int:
-    """Start a new game of SKATE with current user, return game_id.
+    Args:
+        app: the Flask web server application object
+
+    """
+    boards = leaderboards.get_leaderboards(app)
+    if boards.loaded_through is None:
+        with app.app_context():
+            boards.load(_stream_attempts_by_users(app),
+                        _stream_game_outcomes(app))
+    return boards
+
+
+def get_user_names(app: Flask,
+                   user_ids: Optional[Iterable[int]] = None) -> Dict[int, str]:
+    """Look up names of users by id.
+
+    Args:
+        app: the Flask web server application object
+        user_ids: ids of the users, None for all users
+
+    """
+    with app.app_context():
+        query = db.session.query(User.id, User.name)
+        if user_ids is not None:
+            query = query.filter(User.id.in_(list(user_ids)))
+        return dict(query)
+
+
+def list_games(
+    app: Flask,
+    user_id: int,
+    limit: int,
+    before: Optional[Tuple[datetime.datetime, int]] = None
+) -> List[Mapping[str, Any]]:
+    """List a user's games newest first, a page at a time, from stored outcomes.
+
+    Pages by keyset on (start_time, id), so any page costs the same.
+
+    Args:
+        app: the Flask web server application object
+        user_id: id of the user
+        limit: most games to list
+        before: (start time, id) of the last game on the previous page, if any
+
+    """
+    with app.app_context(), user_shard(app, user_id):
+        query = Game.query.filter(Game.user_id == user_id)
+        if before is not None:
+            query = query.filter(
+                tuple_(Game.start_time, Game.id) < tuple_(*before))
+        games = query.order_by(Game.start_time.desc(), Game.id.desc()) \
+                .limit(limit).all()
+        return [{
+            "id": game.id,
+            "start_time": game.start_time,
+            "as_of": game.as_of,
+            "end_time": game.end_time,
+            "user_won": game.user_won,
+            "user_score": game.user_score,
+            "opponent_score": game.opponent_score
+        } for game in games]
+
+
+def get_game_records(
+        app: Flask,
+        user_id: Optional[int] = None) -> Dict[int, Mapping[str, int]]:
+    """Get counts of games won, lost and not finished, by user id.
 
     Args:
         app: the Flask web server application object
-        user: the name of the current user
+        user_id: id of the user, None for all users with games
 
     """
+    rows = []
     with app.app_context():
-        game = Game(attempts=[], user=user)
+        locations = _each_location(app) if user_id is None else \
+                _one_user_location(app, user_id)
+        for _ in locations:
+            query = db.session.query(Game.user_id, Game.user_won,
+                                     func.count(Game.id))
+            if user_id is not None:
+                query = query.filter(Game.user_id == user_id)
+            rows += query.group_by(Game.user_id, Game.user_won).all()
+    records: Dict[int, Mapping[str, int]] = {}
+    for record_user_id, user_won, count in rows:
+        record = records.setdefault(
+            record_user_id, dict.fromkeys(_GAME_RECORD_KEYS.values(), 0))
+        record[_GAME_RECORD_KEYS[user_won]] = count  # type: ignore
+    return records
+
+
+def get_game_record(app: Flask, user_id: int) -> Mapping[str, int]:
+    """Get counts of a user's games won, lost and not finished.
+
+    Args:
+        app: the Flask web server application object
+        user_id: id of the user
+
+    """
+    return get_game_records(app, user_id).get(
+        user_id, dict.fromkeys(_GAME_RECORD_KEYS.values(), 0))
+
+
+def stream_attempt_history(
+    app: Flask,
+    user_id: Optional[int] = None
+) -> Iterator[Tuple[int, int, bool, datetime.datetime]]:
+    """Stream (user id, trick id, landed, time) of attempts by user then time.
+
+    Only the users' own attempts, not past selves'. Rows come off a server-side
+    cursor a batch at a time, so memory stays flat however long the history.
+    Don't call other functions here that make their own app context while
+    iterating, their teardown would end the session the cursor is on.
+
+    Args:
+        app: the Flask web server application object
+        user_id: id of the user, None for all users
+
+    """
+    with app.app_context():
+        locations = _each_location(app) if user_id is None else \
+                _one_user_location(app, user_id)
+        for _ in locations:
+            query = db.session.query(Attempt.user_id, Attempt.trick_id,
+                                     Attempt.landed, Attempt.time_of_attempt) \
+                    .filter(Attempt.is_past_self.is_(False))
+            if user_id is not None:
+                query = query.filter(Attempt.user_id == user_id)
+            query = query.order_by(Attempt.user_id, Attempt.time_of_attempt,
+                                   Attempt.id) \
+                    .execution_options(stream_results=True) \
+                    .yield_per(_STREAM_BATCH_ROWS)
+            for row in query:
+                yield tuple(row)  # type: ignore
+
+
+def get_attempt_counts_by_user_trick(
+        app: Flask) -> List[Tuple[int, int, int, int]]:
+    """Get (user id, trick id, attempts, lands) of every user on every trick.
+
+    One aggregate query over all attempts not by past selves, for building
+    cross-user models without a query per user.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    counts = []
+    with app.app_context():
+        for _ in _each_location(app):
+            counts += db.session.query(
+                Attempt.user_id, Attempt.trick_id, func.count(Attempt.id),
+                func.count(Attempt.id).filter(Attempt.landed)).filter(
+                    Attempt.is_past_self.is_(False)).group_by(
+                        Attempt.user_id, Attempt.trick_id).all()
+    return counts
+
+
+def start_game(app: Flask,
+               user_id: int,
+               as_of: Optional[datetime.datetime] = None) -> int:
+    """Start a new game of SKATE with current user, return game_id.
+
+    Args:
+        app: the Flask web server application object
+        user_id: id of the current user
+        as_of: play against the user as they were at this time, None for now
+
+    """
+    with app.app_context(), user_shard(app, user_id):
+        game = Game(attempts=[], user_id=user_id, as_of=as_of)
         db.session.add(game)
         db.session.commit()
         app.logger.info("Started new game with id %s", game.id)
 
+    _schedule_prepared_rates(app, user_id, game.id)
     return game.id
 
 
-def get_trick_view_params(user: str, trick: Trick) -> Mapping[str, Any]:
+def get_trick_view_params(app: Flask, user_id: int, trick_id: int,
+                          trick_name: str) -> Mapping[str, Any]:
     """Get parameters to render landing page view of trick and stats on it.
 
+    Counts include the user's buffered attempts, if write-behind is on.
+
     Args:
-        user: the currente Skrate user
-        trick: the Trick object representing the type of trick
+        app: the Flask server application object
+        user_id: id of the current Skrate user
+        trick_id: id of the type of trick
+        trick_name: name of the type of trick
 
     """
 
-    user_attempts = Attempt.query.filter_by(user=user,
-                                            trick_id=trick.id).count()
-    user_lands = Attempt.query.filter_by(user=user,
-                                         trick_id=trick.id,
-                                         landed=True).count()
+    def count_attempts() -> Tuple[int, int]:
+        """Get the user's attempts and lands at the trick in the database."""
+        user_attempts = Attempt.query.filter_by(user_id=user_id,
+                                                is_past_self=False,
+                                                trick_id=trick_id).count()
+        user_lands = Attempt.query.filter_by(user_id=user_id,
+                                             is_past_self=False,
+                                             trick_id=trick_id,
+                                             landed=True).count()
+        return user_attempts, user_lands
+
+    buffer = attempt_buffer.get_attempt_buffer(app)
+    user_attempts, user_lands = count_attempts() if buffer is None else \
+            buffer.read_through(count_attempts, user_id, trick_id)
     return {
         "attempts": user_attempts,
         "lands": user_lands,
-        "name": trick.name,
-        "id": trick.id
+        "name": trick_name,
+        "id": trick_id
     }
 
 
-def get_all_trick_infos(app: Flask, user: str) -> List[Mapping[str, Any]]:
+def get_all_trick_infos(app: Flask,
+                        user_id: int,
+                        offset: int = 0,
+                        limit: Optional[int] = None) -> List[Mapping[str, Any]]:
     """Get list of all trick infos and user stats on them, ordered by land rate.
-    
+
+    Shared tricks and the user's own custom ones. With offset and limit only a
+    page of them, stats are only looked up for the tricks on the page.
+
     Args:
         app: the Flask server application object
-        user: user current logged in in session
+        user_id: id of user currently logged in in session
+        offset: how many tricks to skip, from the best land rate
+        limit: most tricks to get, None for all the rest
 
     """
-    all_tricks = Trick.query.all()
-    trick_odds_dict = game_logic.get_odds_lookup_dict(app, user, db)
-    tricks_sorted = sorted(all_tricks,
-                           key=lambda trick: trick_odds_dict[trick.id],
-                           reverse=True)
-    return [get_trick_view_params(user, trick) for trick in tricks_sorted]
+    trick_names = get_trick_registry(app)
+    with user_shard(app, user_id):
+        trick_odds_dict = game_logic.get_odds_lookup_dict(app, user_id, db)
+        tricks_sorted = sorted(
+            trick_names.visible_to(user_id),
+            key=lambda trick_id: trick_odds_dict.get(trick_id, 0.0),
+            reverse=True)
+        page = tricks_sorted[offset:None if limit is None else offset + limit]
+        return [
+            get_trick_view_params(app, user_id, trick_id, trick_names[trick_id])
+            for trick_id in page
+        ]
 
 
 def get_skate_letters_colors(score: int) -> List[Mapping[str, str]]:
@@ -211,19 +1566,18 @@ def get_skate_letters_colors(score: int) -> List[Mapping[str, str]]:
     } for i, letter in enumerate(game_logic.LETTERS)]
 
 
-def get_latest_game_params(app: Flask, user: str,
+def get_latest_game_params(app: Flask, user_id: int,
                            game_id: int) -> Mapping[str, Any]:
     """Get parameters to render the game view.
 
     Args:
         app: the server flask application object
-        user: current user
+        user_id: id of current user
         game_id: current game id
 
     """
-    with app.app_context():
-        latest_game = Game.query.filter(Game.user == user, Game.id == game_id) \
-                .order_by(Game.start_time).first()
+    with app.app_context(), user_shard(app, user_id):
+        latest_game = _load_game(game_id, user_id)
         if latest_game is None:
             turn_lines = [{
                 "classes": "list-group-item",
@@ -233,44 +1587,55 @@ def get_latest_game_params(app: Flask, user: str,
                 "new": get_skate_letters_colors(0),
                 "past": get_skate_letters_colors(0)
             }
-        else:
-            # This utilizes the actual game rules to generate output so far
-            game_state = get_game_state(latest_game.attempts, user)
-            turn_lines = [{
-                "classes": "list-group-item " + msg.msg_type,
-                "text": msg.msg_text
-            } for msg in game_state.status_feed]
-            letters_colors = {
-                "new": get_skate_letters_colors(game_state.user_score),
-                "past": get_skate_letters_colors(game_state.opponent_score)
-            }
+            return {"turn_lines": turn_lines, "letters_colors": letters_colors}
+
+        # This utilizes the actual game rules to generate output so far
+        return game_view_params(
+            get_game_state(latest_game.attempts, latest_game.user.name,
+                           get_trick_registry(app)))
 
-        return {"turn_lines": turn_lines, "letters_colors": letters_colors}
 
+def game_view_params(game_state: game_logic.GameState) -> Mapping[str, Any]:
+    """Get parameters to render the game view of a game's state.
 
-def get_game_state(attempts: List[Attempt],
-                   user_name: str) -> game_logic.GameState:
+    Args:
+        game_state: the game's state, e.g. as a turn just left it
+
+    """
+    return {
+        "turn_lines": [{
+            "classes": "list-group-item " + msg.msg_type,
+            "text": msg.msg_text
+        } for msg in game_state.status_feed],
+        "letters_colors": {
+            "new": get_skate_letters_colors(game_state.user_score),
+            "past": get_skate_letters_colors(game_state.opponent_score)
+        }
+    }
+
+
+def get_game_state(attempts: List[Attempt], user_name: str,
+                   trick_names: Mapping[int, str]) -> game_logic.GameState:
     """Calculate the game state given ordered list of attempts.
 
     Args:
-        attempts: the attempts by either user in this game
+        attempts: the attempts by either user in this game, in time order
+            (as Game.attempts are)
         user_name: the user name logged in as
+        trick_names: name of each trick by id, e.g. from the trick registry
 
     """
-    # Bit wasteful to do this each time want it, but still plenty fast
-    sorted_attempts = sorted(attempts, key=lambda a: a.time_of_attempt)
-
     # Sanity check, confirm alternating turns starting with user
-    assert all(a.user == user_name
-               for a in sorted_attempts[::2]), game_logic._TURN_FAULT
-    assert all(a.user != user_name
-               for a in sorted_attempts[1::2]), game_logic._TURN_FAULT
+    assert not any(
+        a.is_past_self for a in attempts[::2]), game_logic._TURN_FAULT
+    assert all(a.is_past_self for a in attempts[1::2]), game_logic._TURN_FAULT
 
     # Build up state and return it... note if no attempts yet that's ok
     game_state = game_logic.GameState(user_name)
-    for attempt in sorted_attempts:
-        if game_state.apply_attempt(attempt.trick_id, attempt.trick.name,
-                                    attempt.landed, attempt.user):
+    for attempt in attempts:
+        if game_state.apply_attempt(attempt.trick_id,
+                                    trick_names[attempt.trick_id],
+                                    attempt.landed, attempt.is_past_self):
             break
 
     return game_state
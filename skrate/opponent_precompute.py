@@ -0,0 +1,203 @@
+"""Background precompute of what past self plays next in games.
+
+Past self's response to a turn (which trick to try, and the odds of landing
+it) only needs the user's land rates, known as soon as the previous turn ends.
+So after each turn the rates are read in the background, and kept with the
+game until the user's next attempt, which then plays past self's response
+without querying. The user's attempt only moves the rate window of the trick
+they try, so the rates of each trick after another attempt at it are read as
+well, covering the user landing or missing any trick.
+
+Prepared rates are used only if the user has recorded no attempts since they
+were read, going by the fragment cache's versions, so like those this assumes
+a single server process.
+"""
+import collections
+import concurrent.futures
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from flask import Flask
+
+# Key under app.extensions holding the precompute for that app
+_EXTENSION_KEY = "skrate_opponent_precompute"
+
+# Default most games to hold prepared rates for, dropping oldest
+_DEFAULT_MAX_GAMES = 10000
+
+
+class PreparedRates:
+    """A user's land rates as past self will see them on a game's next turn."""
+
+    def __init__(self, game_id: int, n_attempts: int, stats_version: int,
+                 rates: Dict[int, float],
+                 rates_if_attempted: Optional[Dict[int, float]]) -> None:
+        """Initialize prepared rates.
+
+        Args:
+            game_id: id of the game
+            n_attempts: attempts in the game when read
+            stats_version: the user's stats version (see FragmentCache) from
+                before the rates were read
+            rates: land rate by trick id, best first
+            rates_if_attempted: land rate of each trick once the user attempts
+                it again, None if attempts now don't count (as_of games)
+
+        """
+        self.game_id = game_id
+        self.n_attempts = n_attempts
+        self.stats_version = stats_version
+        self._rates = rates
+        self._rates_if_attempted = rates_if_attempted
+
+    def is_current(self, n_attempts: int, stats_version: int) -> bool:
+        """Whether the rates are still those of the game's next turn.
+
+        Args:
+            n_attempts: attempts in the game now, before the user's
+            stats_version: the user's stats version now
+
+        """
+        return self.n_attempts == n_attempts and \
+                self.stats_version == stats_version
+
+    def odds(self, trick_id: int, attempted_id: int) -> float:
+        """Get odds of past self landing a trick, after the user's attempt.
+
+        Args:
+            trick_id: id of the trick past self tries
+            attempted_id: id of the trick the user just attempted
+
+        Raises:
+            ValueError: if the trick isn't one the user has rates for
+
+        """
+        if trick_id not in self._rates:
+            raise ValueError("Requested odds for non-existent trick id " +
+                             str(trick_id))
+        if trick_id == attempted_id and self._rates_if_attempted is not None:
+            return self._rates_if_attempted[trick_id]
+        return self._rates[trick_id]
+
+    def trick_ids_by_rate(self, attempted_id: int) -> List[int]:
+        """Get trick ids best rate first, after the user's attempt.
+
+        Args:
+            attempted_id: id of the trick the user just attempted
+
+        """
+        trick_ids = list(self._rates)
+        if self._rates_if_attempted is None or \
+                self._rates_if_attempted.get(attempted_id) == \
+                self._rates.get(attempted_id):
+            return trick_ids
+        # Stable, so other tricks keep the order the query gave them
+        return sorted(trick_ids,
+                      key=lambda trick_id: -self.odds(trick_id, attempted_id))
+
+
+class OpponentPrecompute:
+    """Worker threads preparing rates, and the rates prepared for each game."""
+
+    def __init__(self,
+                 prepare: Callable[[int, int], Optional[PreparedRates]],
+                 workers: int,
+                 logger: logging.Logger,
+                 max_games: int = _DEFAULT_MAX_GAMES) -> None:
+        """Initialize with nothing prepared.
+
+        Args:
+            prepare: reads the rates for a user's game, given user id and game
+                id, None if the game is over
+            workers: most games to prepare at once
+            logger: where to log failures to prepare
+            max_games: most games to hold prepared rates for
+
+        """
+        self._prepare = prepare
+        self._logger = logger
+        self.max_games = max_games
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            workers, thread_name_prefix="skrate-opponent")
+        self._lock = threading.Lock()
+        self._prepared: "collections.OrderedDict[int, PreparedRates]" = \
+                collections.OrderedDict()
+        self._futures: List[concurrent.futures.Future] = []
+
+    def schedule(self, user_id: int, game_id: int) -> None:
+        """Prepare rates for a game's next turn in the background.
+
+        Args:
+            user_id: id of the game's user
+            game_id: id of the game
+
+        """
+        future = self._executor.submit(self._run, user_id, game_id)
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            self._futures.append(future)
+
+    def _run(self, user_id: int, game_id: int) -> None:
+        """Prepare rates for a game and keep them, in a worker thread."""
+        try:
+            prepared = self._prepare(user_id, game_id)
+        except Exception:
+            self._logger.exception("Failed to prepare game %s", game_id)
+            return
+        if prepared is None:
+            return
+        with self._lock:
+            earlier = self._prepared.get(game_id)
+            if earlier is not None and earlier.n_attempts > prepared.n_attempts:
+                return  # a later turn's rates finished first
+            self._prepared[game_id] = prepared
+            self._prepared.move_to_end(game_id)
+            while len(self._prepared) > self.max_games:
+                self._prepared.popitem(last=False)
+
+    def take(self, game_id: int) -> Optional[PreparedRates]:
+        """Get and forget the rates prepared for a game, None if not ready.
+
+        Args:
+            game_id: id of the game
+
+        """
+        with self._lock:
+            return self._prepared.pop(game_id, None)
+
+    def wait(self) -> None:
+        """Wait for games scheduled so far to be prepared."""
+        with self._lock:
+            futures = list(self._futures)
+        concurrent.futures.wait(futures)
+
+    def close(self) -> None:
+        """Stop the worker threads, after preparing what's scheduled."""
+        self._executor.shutdown()
+
+
+def init_opponent_precompute(app: Flask,
+                             prepare: Callable[[int, int],
+                                               Optional[PreparedRates]],
+                             workers: int) -> None:
+    """Give the app an opponent precompute.
+
+    Args:
+        app: the Flask web server application object
+        prepare: reads the rates for a user's game, see OpponentPrecompute
+        workers: most games to prepare at once
+
+    """
+    app.extensions[_EXTENSION_KEY] = OpponentPrecompute(prepare, workers,
+                                                        app.logger)
+
+
+def get_opponent_precompute(app: Flask) -> Optional[OpponentPrecompute]:
+    """Get the opponent precompute of an app, None if moves are made live.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    return app.extensions.get(_EXTENSION_KEY)
@@ -0,0 +1,175 @@
+"""On-demand profiling of sampled requests, with the SQL statements they ran.
+
+Set SKRATE_PROFILE_DIR to profile a SKRATE_PROFILE_SAMPLE fraction of requests. In
+debug mode a request can also ask for it with the PROFILE_HEADER header. Each
+profiled request writes <name>.prof (load with pstats or snakeviz) and
+<name>.sql.json next to it. Write a rate to SAMPLE_RATE in the profile directory to
+change sampling without a restart, e.g. 0 to turn it off. Nothing is hooked up
+unless a profile directory is set or the app is in debug mode.
+"""
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from flask import Flask, current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Request header asking for a profile of that request, honored in debug mode only
+PROFILE_HEADER = "X-Skrate-Profile"
+
+# File in profile directory whose content overrides the sample rate
+_SAMPLE_RATE_FILE = "SAMPLE_RATE"
+
+# Check for changes to the sample rate file at most this often
+_SAMPLE_RATE_CHECK_SECONDS = 1.0
+
+# Where profiles go if only asking by header in debug mode
+_DEFAULT_DEBUG_PROFILE_DIR = "/tmp/skrate_profiles"
+
+# Profile and statements of the request being profiled on this thread, if any
+_current = threading.local()
+
+
+class _SampleRate:
+    """Sample rate from app config, overridden by rate file when present."""
+
+    def __init__(self, profile_dir: str, default_rate: float) -> None:
+        """Initialize sample rate.
+
+        Args:
+            profile_dir: directory where profiles and the rate file go
+            default_rate: rate to use if no rate file
+
+        """
+        self._path = os.path.join(profile_dir, _SAMPLE_RATE_FILE)
+        self._default_rate = default_rate
+        self._rate = default_rate
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+
+    def get(self) -> float:
+        """Get the current sample rate, re-reading the rate file if changed."""
+        now = time.monotonic()
+        if now < self._next_check:
+            return self._rate
+        self._next_check = now + _SAMPLE_RATE_CHECK_SECONDS
+
+        try:
+            mtime: Optional[float] = os.stat(self._path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self._rate = self._default_rate
+            if mtime is not None:
+                try:
+                    with open(self._path) as rate_file:
+                        self._rate = float(rate_file.read().strip() or 0)
+                except (OSError, ValueError):
+                    current_app.logger.warning("Unreadable sample rate in %s",
+                                               self._path)
+        return self._rate
+
+
+def _record_statement_start(conn: Any, cursor: Any, statement: str,
+                            parameters: Any, context: Any,
+                            executemany: bool) -> None:
+    """Engine hook noting start time of statement, if profiling this thread."""
+    if getattr(_current, "statements", None) is not None:
+        conn.info.setdefault("skrate_profile_start",
+                             []).append(time.perf_counter())
+
+
+def _record_statement_end(conn: Any, cursor: Any, statement: str,
+                          parameters: Any, context: Any,
+                          executemany: bool) -> None:
+    """Engine hook recording a statement run, if profiling this thread."""
+    statements = getattr(_current, "statements", None)
+    if statements is not None and conn.info.get("skrate_profile_start"):
+        start = conn.info["skrate_profile_start"].pop()
+        statements.append({
+            "statement": statement,
+            "duration_ms": (time.perf_counter() - start) * 1000.0
+        })
+
+
+def _start_profile() -> None:
+    """Before request, start profiling it if sampled or asked for."""
+    sample_rate: _SampleRate = current_app.extensions["skrate_profile_rate"]
+    asked = current_app.debug and request.headers.get(PROFILE_HEADER)
+    if not asked and random.random() >= sample_rate.get():
+        return
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Only one profiler at a time in some Python versions, skip this one
+        return
+    _current.profile = profile
+    _current.statements = []
+    _current.start = time.perf_counter()
+
+
+def _finish_profile(exc: Optional[BaseException]) -> None:
+    """On request teardown, stop profiling and write results if profiling."""
+    profile: Optional[cProfile.Profile] = getattr(_current, "profile", None)
+    if profile is None:
+        return
+    profile.disable()
+    statements: List[Dict[str, Any]] = _current.statements
+    duration_ms = (time.perf_counter() - _current.start) * 1000.0
+    _current.profile = None
+    _current.statements = None
+
+    profile_dir = current_app.config["SKRATE_PROFILE_DIR"] or \
+            _DEFAULT_DEBUG_PROFILE_DIR
+    name = "{}_{}_{}".format(time.strftime("%Y%m%d-%H%M%S"), request.endpoint or
+                             "unknown",
+                             "{:06d}".format(random.randrange(10**6)))
+    profile.dump_stats(os.path.join(profile_dir, name + ".prof"))
+    with open(os.path.join(profile_dir, name + ".sql.json"), "w") as sql_file:
+        json.dump(
+            {
+                "path": request.path,
+                "endpoint": request.endpoint,
+                "duration_ms": duration_ms,
+                "error": repr(exc) if exc is not None else None,
+                "statements": statements
+            },
+            sql_file,
+            indent=2)
+    current_app.logger.info("Profiled %s in %.1f ms, %d SQL statements: %s",
+                            request.path, duration_ms, len(statements), name)
+
+
+def init_profiling(app: Flask) -> None:
+    """Hook up request profiling, if a profile directory set or in debug mode.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    profile_dir = app.config["SKRATE_PROFILE_DIR"]
+    if not profile_dir and not app.debug:
+        return
+
+    profile_dir = profile_dir or _DEFAULT_DEBUG_PROFILE_DIR
+    os.makedirs(profile_dir, exist_ok=True)
+    app.extensions["skrate_profile_rate"] = _SampleRate(
+        profile_dir, app.config["SKRATE_PROFILE_SAMPLE"])
+
+    # Hooks on all engines are shared across apps, only listen once
+    if not event.contains(Engine, "before_cursor_execute",
+                          _record_statement_start):
+        event.listen(Engine, "before_cursor_execute", _record_statement_start)
+        event.listen(Engine, "after_cursor_execute", _record_statement_end)
+
+    app.before_request(_start_profile)
+    app.teardown_request(_finish_profile)
+    app.logger.info("Profiling requests to %s", profile_dir)
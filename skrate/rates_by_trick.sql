@@ -1,52 +1,34 @@
 -- Get recent success rate of a user for each trick, over last X attempts of that trick (minus most
--- recent, for in current game of SKATE). FYI the table name in attempt.user is important here - see
--- https://dba.stackexchange.com/questions/75551/returning-rows-in-postgresql-with-a-table-called-user
+-- recent, for in current game of SKATE) before the as-of time. Only the user's own attempts count,
+-- not past self attempts made up in games.
 
-
--- First get all attempts by user, indexed by how many times user has tried that trick since 
-WITH attempts_indexed AS 
-( 
-         SELECT   trick_id, 
-                  Row_number() OVER (partition BY trick_id ORDER BY time_of_attempt DESC) AS tries_ago,
-                  landed 
-         FROM     attempt 
-         WHERE    attempt.USER = :username ) 
--- Limit at most to only the last _ times we tried each trick, minus most recent
-, attempts_recent AS 
-( 
-         SELECT   trick_id, 
-                  Sum( 
-                  CASE 
-                           WHEN landed THEN 1 
-                           ELSE 0 
-                  END) AS n_landed, 
-                  Sum( 
-                  CASE 
-                           WHEN landed THEN 0 
-                           ELSE 1 
-                  END) AS n_missed 
-         FROM     attempts_indexed 
-         WHERE    tries_ago <= :nlimit and tries_ago > :nmin
-         GROUP BY trick_id ) 
--- If above data set doesn't provide insight on a trick, fallback any trick is 0.0 
-, all_tricks_zeros AS 
-( 
-       SELECT id as trick_id, 
-              0.0 AS land_rate_recent 
-       FROM   trick ) 
--- Divide out for success rate, handle div by 0 error 
-, unordered AS 
-( 
-       SELECT trick_id, 
-              CASE 
-                     WHEN n_landed          + n_missed = 0 THEN 0.0 
-                     ELSE n_landed::decimal / (n_landed + n_missed)::decimal 
-              END AS land_rate_recent 
-       FROM   attempts_recent ) 
--- Lastly combined tried and not tried, and sort for best success rates first 
-SELECT all_tricks_zeros.trick_id,
-       coalesce(unordered.land_rate_recent, all_tricks_zeros.land_rate_recent) as land_rate_recent
-FROM   unordered
-RIGHT OUTER JOIN all_tricks_zeros
-              ON unordered.trick_id = all_tricks_zeros.trick_id
+-- Each trick's window is read newest first off the ix_attempt_user_trick_time index (user_id,
+-- is_past_self, trick_id, time_of_attempt), so only the window's rows are touched however much
+-- history there is, and however far back the as-of time is.
+SELECT    trick.id AS trick_id,
+          coalesce(recent.land_rate_recent, 0.0) AS land_rate_recent
+FROM      trick
+-- If no attempts in the window for a trick, fallback rate is 0.0
+LEFT JOIN LATERAL
+(
+          SELECT avg(
+                 CASE
+                        WHEN landed THEN 1.0
+                        ELSE 0.0
+                 END) AS land_rate_recent
+          FROM   (
+                          SELECT   landed
+                          FROM     attempt
+                          WHERE    attempt.user_id = :user_id
+                          AND      NOT attempt.is_past_self
+                          AND      attempt.trick_id = trick.id
+                          AND      attempt.time_of_attempt < :as_of
+                          ORDER BY attempt.time_of_attempt DESC
+                          LIMIT    :nlimit - :nmin
+                          OFFSET   :nmin ) AS tries ) AS recent
+ON        TRUE
+-- Shared tricks and the user's own custom ones, not other users'
+WHERE     trick.owner_id IS NULL
+OR        trick.owner_id = :user_id
+-- Lastly sort for best success rates first
 ORDER BY 2 DESC
@@ -0,0 +1,220 @@
+"""Recommend tricks to practice next, from all users' land rates with NumPy.
+
+A user x trick matrix of land rates is built from one aggregate query, then
+trick difficulty, trick to trick similarity (cosine over users' centered land
+rates) and every user's predicted land rate on every trick come out of a few
+matrix products. The tricks a user is predicted to land best, without having
+mastered them yet, are recommended. The model is rebuilt periodically on a
+background thread and swapped in whole, requests only look up their user.
+
+NumPy is optional (pip install skrate[recommend]), without it the endpoint
+reports recommendations are unavailable.
+"""
+import datetime
+import threading
+import time
+from typing import Any, List, Mapping, Optional
+
+from flask import Flask
+
+from skrate import models
+from skrate import tricks
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+# Key under app.extensions holding the recommender for that app
+_EXTENSION_KEY = "skrate_recommender"
+
+# Pull each user's rate on a trick toward the trick's overall rate, as if this
+# many more attempts at the overall rate
+_PRIOR_ATTEMPTS = 5.0
+
+# Land rate at or above which a trick counts as mastered, not worth practicing
+_MASTERED_RATE = 0.8
+
+# Recommendations kept per user
+_TOP_K = 10
+
+
+class RecommendationModel:
+    """Trick difficulties and per-user recommendations, computed at once."""
+
+    def __init__(self, trick_ids: List[int], user_ids: List[int], attempts: Any,
+                 lands: Any) -> None:
+        """Compute the model from attempt and land count matrices.
+
+        Args:
+            trick_ids: trick id of each matrix column, catalog order
+            user_ids: user id of each matrix row
+            attempts: user x trick array of attempt counts
+            lands: user x trick array of land counts
+
+        """
+        self.computed_at = datetime.datetime.utcnow()
+        self.trick_ids = trick_ids
+        self.n_users = len(user_ids)
+        self._user_rows = {user_id: row for row, user_id in enumerate(user_ids)}
+
+        # Overall rate per trick, and users' rates smoothed toward it
+        trick_rates = (lands.sum(axis=0) + 1.0) / (attempts.sum(axis=0) + 2.0)
+        self.difficulty = 1.0 - trick_rates
+        rates = (lands + _PRIOR_ATTEMPTS * trick_rates) / (attempts +
+                                                           _PRIOR_ATTEMPTS)
+        tried = attempts > 0
+
+        # Trick similarity, cosine of rates centered per user, tried tricks only
+        user_means = np.where(tried.any(axis=1), (rates * tried).sum(axis=1) /
+                              np.maximum(tried.sum(axis=1), 1), 0.0)
+        centered = (rates - user_means[:, None]) * tried
+        norms = np.linalg.norm(centered, axis=0)
+        norms[norms == 0.0] = 1.0
+        similarity = (centered.T @ centered) / np.outer(norms, norms)
+        np.fill_diagonal(similarity, 0.0)
+
+        # Predicted rate of every user on every trick, from similar tricks tried
+        weights = tried @ np.abs(similarity)
+        predicted = user_means[:, None] + np.divide(centered @ similarity,
+                                                    weights,
+                                                    out=np.zeros_like(weights),
+                                                    where=weights > 0.0)
+        self.predicted = np.clip(np.where(tried, rates, predicted), 0.0, 1.0)
+
+        # Best predicted tricks not mastered yet, per user
+        candidates = np.where(self.predicted < _MASTERED_RATE, self.predicted,
+                              -1.0)
+        top_k = min(_TOP_K, len(trick_ids))
+        self.top_columns = np.argsort(-candidates, axis=1)[:, :top_k]
+        self.easiest_columns = np.argsort(self.difficulty)[:top_k]
+
+    def recommend(self, user_id: int) -> List[Mapping[str, Any]]:
+        """Get recommended trick ids with predicted land rate and difficulty.
+
+        Users not in the model yet get the easiest tricks.
+
+        Args:
+            user_id: id of the user
+
+        """
+        row = self._user_rows.get(user_id)
+        if row is None:
+            return [{
+                "id": self.trick_ids[column],
+                "predicted_land_rate": None,
+                "difficulty": float(self.difficulty[column])
+            } for column in self.easiest_columns]
+        return [{
+            "id": self.trick_ids[column],
+            "predicted_land_rate": float(self.predicted[row, column]),
+            "difficulty": float(self.difficulty[column])
+        } for column in self.top_columns[row]]
+
+
+def build_model(app: Flask) -> RecommendationModel:
+    """Build the recommendation model from all users' attempts.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    # Only shared tricks, not users' own
+    registry = models.get_trick_registry(app)
+    shared_ids = registry.visible_to(None)
+    ids_by_name = {registry[trick_id]: trick_id for trick_id in shared_ids}
+    trick_ids = [
+        ids_by_name[name]
+        for name in tricks.all_tricks_variants()
+        if name in ids_by_name
+    ]
+    trick_ids += sorted(set(shared_ids) - set(trick_ids))
+    columns = {trick_id: column for column, trick_id in enumerate(trick_ids)}
+
+    counts = [
+        row for row in models.get_attempt_counts_by_user_trick(app)
+        if row[1] in columns
+    ]
+    user_ids = sorted({user_id for user_id, _, _, _ in counts})
+    rows = {user_id: row for row, user_id in enumerate(user_ids)}
+    attempts = np.zeros((len(user_ids), len(trick_ids)))
+    lands = np.zeros((len(user_ids), len(trick_ids)))
+    if counts:
+        user_idx, trick_idx, n_attempts, n_lands = zip(
+            *((rows[user_id], columns[trick_id], n_attempts, n_lands)
+              for user_id, trick_id, n_attempts, n_lands in counts))
+        attempts[user_idx, trick_idx] = n_attempts
+        lands[user_idx, trick_idx] = n_lands
+    return RecommendationModel(trick_ids, user_ids, attempts, lands)
+
+
+class Recommender:
+    """Holds the latest model, rebuilt periodically on a background thread."""
+
+    def __init__(self, app: Flask, refresh_seconds: float) -> None:
+        """Initialize a recommender, built on first use.
+
+        Args:
+            app: the Flask web server application object
+            refresh_seconds: rebuild the model this often, 0 to never rebuild
+
+        """
+        self._app = app
+        self._refresh_seconds = refresh_seconds
+        self._model: Optional[RecommendationModel] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self) -> RecommendationModel:
+        """Rebuild the model now and swap it in."""
+        model = build_model(self._app)
+        self._model = model
+        self._app.logger.info("Rebuilt recommendations for %s users.",
+                              model.n_users)
+        return model
+
+    def _refresh_forever(self) -> None:
+        """Background thread body, rebuilding the model every so often."""
+        while True:
+            time.sleep(self._refresh_seconds)
+            try:
+                self.refresh()
+            except Exception:  # keep serving the old model, try again later
+                self._app.logger.exception("Rebuilding recommendations failed")
+
+    def model(self) -> RecommendationModel:
+        """Get the latest model, building it and starting refreshes if first."""
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                self.refresh()
+                if self._refresh_seconds > 0:
+                    self._thread = threading.Thread(
+                        target=self._refresh_forever,
+                        name="skrate-recommendations",
+                        daemon=True)
+                    self._thread.start()
+        return self._model  # type: ignore
+
+
+def init_recommender(app: Flask, refresh_seconds: float) -> None:
+    """Give the app a recommender, if NumPy is installed.
+
+    Args:
+        app: the Flask web server application object
+        refresh_seconds: rebuild the model this often, 0 to never rebuild
+
+    """
+    if np is not None:
+        app.extensions[_EXTENSION_KEY] = Recommender(app, refresh_seconds)
+
+
+def get_recommender(app: Flask) -> Optional[Recommender]:
+    """Get the recommender of an app, None if NumPy isn't installed.
+
+    Args:
+        app: the Flask web server application object
+
+    """
+    return app.extensions.get(_EXTENSION_KEY)
@@ -0,0 +1,298 @@
+"""Bulk synthetic users, attempts and games, for trying Skrate queries at scale.
+
+Each synthetic skater has a talent, and gets better at each trick with practice
+along a learning curve, with harder tricks (later in tricks._TRICKS, and switch,
+nollie or fakie variants) landed less and learned slower. Rows are written with
+Postgres COPY in batches, bypassing the app, so run against a database no server
+is using (its caches won't know about the new rows).
+"""
+import csv
+import datetime
+import io
+import math
+import random
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+from flask import Flask
+
+from skrate import game_logic
+from skrate import models
+from skrate import tricks
+
+# Rows to COPY to the database at once, bounds memory use
+_COPY_BATCH_ROWS = 100000
+
+# Extra difficulty of trick variants over the base trick
+_PREFIX_DIFFICULTY = {"Fakie ": 0.05, "Nollie ": 0.1, "Switch ": 0.15}
+
+# Synthetic history spans this many days up to now
+_HISTORY_DAYS = 365
+
+# Give up on a synthetic game after this many turns (leave it unfinished)
+_MAX_GAME_TURNS = 200
+
+# Seeded user names, numbered
+_USER_NAME_FORMAT = "seed_user_{}"
+
+# Game columns in the order written
+_GAME_COLUMNS = ("id", "user_id", "start_time", "end_time", "user_won",
+                 "user_score", "opponent_score")
+
+# Attempt columns in the order written
+_ATTEMPT_COLUMNS = ("trick_id", "game_id", "user_id", "is_past_self", "landed",
+                    "time_of_attempt")
+
+
+def trick_difficulties() -> Dict[str, float]:
+    """Get difficulty of each trick variant, from 0 (easiest) to about 1."""
+    difficulties = {}
+    for i, trick_tuple in enumerate(tricks._TRICKS):
+        base_difficulty = i / len(tricks._TRICKS)
+        for name in tricks.trick_variants(trick_tuple):
+            prefix = name[:len(name) - len(trick_tuple[0])]
+            difficulties[name] = base_difficulty + _PREFIX_DIFFICULTY.get(
+                prefix, 0.0)
+    return difficulties
+
+
+class _SyntheticSkater:
+    """Land probability of a made-up skater, improving with practice."""
+
+    def __init__(self, rng: random.Random,
+                 difficulties: Mapping[int, float]) -> None:
+        """Initialize a skater with random talent.
+
+        Args:
+            rng: random generator to draw from
+            difficulties: difficulty of each trick by trick id
+
+        """
+        talent = rng.uniform(0.5, 1.5)
+        self._rng = rng
+        self._tries: Dict[int, int] = {}
+        self._best_rate: Dict[int, float] = {}
+        self._learn_tries: Dict[int, float] = {}
+        for trick_id, difficulty in difficulties.items():
+            self._best_rate[trick_id] = min(
+                0.95,
+                max(0.02,
+                    0.95 - 0.8 * difficulty / talent + rng.gauss(0, 0.05)))
+            self._learn_tries[trick_id] = (20 + 200 * difficulty) / talent
+        self.trick_ids = list(difficulties)
+        # Practice the easier tricks more
+        self.trick_weights = [
+            math.exp(-3 * difficulties[trick_id]) for trick_id in self.trick_ids
+        ]
+
+    def land_rate(self, trick_id: int) -> float:
+        """Get current chance of landing a trick.
+
+        Args:
+            trick_id: id of the trick
+
+        """
+        tries = self._tries.get(trick_id, 0)
+        return self._best_rate[trick_id] * (
+            1 - math.exp(-(tries + 1) / self._learn_tries[trick_id]))
+
+    def attempt(self, trick_id: int) -> bool:
+        """Try a trick, return whether landed, and learn from it.
+
+        Args:
+            trick_id: id of the trick
+
+        """
+        landed = self._rng.random() < self.land_rate(trick_id)
+        self._tries[trick_id] = self._tries.get(trick_id, 0) + 1
+        return landed
+
+    def pick_trick(self, prohibited: Sequence[int] = ()) -> int:
+        """Pick a trick to try, more likely an easy one.
+
+        Args:
+            prohibited: trick ids not allowed
+
+        """
+        if not prohibited:
+            return self._rng.choices(self.trick_ids, self.trick_weights)[0]
+        allowed = [
+            (trick_id, weight)
+            for trick_id, weight in zip(self.trick_ids, self.trick_weights)
+            if trick_id not in prohibited
+        ]
+        return self._rng.choices([trick_id for trick_id, _ in allowed],
+                                 [weight for _, weight in allowed])[0]
+
+
+def _simulate_game(
+    skater: _SyntheticSkater, past_skater: _SyntheticSkater
+) -> Tuple[List[Tuple[int, bool, bool]], game_logic.GameState]:
+    """Play a game of SKATE by the game rules, skater vs. their past self.
+
+    Args:
+        skater: the skater now
+        past_skater: the same skater as they used to be
+
+    Returns:
+        Turns in order as (trick id, landed, is past self), and final state
+
+    """
+    game_state = game_logic.GameState("")
+    turns: List[Tuple[int, bool, bool]] = []
+    is_past_self = False
+    while game_state.is_ongoing() and len(turns) < _MAX_GAME_TURNS:
+        player = past_skater if is_past_self else skater
+        trick_id = game_state.challenging_move_id
+        if trick_id is None:
+            trick_id = player.pick_trick(game_state.trick_ids_used_up)
+        landed = player.attempt(trick_id)
+        turns.append((trick_id, landed, is_past_self))
+        game_state.apply_attempt(trick_id, "", landed, is_past_self)
+        is_past_self = not is_past_self
+    return turns, game_state
+
+
+def _copy_rows(cursor: object, table: str, columns: Sequence[str],
+               rows: List[Sequence[object]]) -> None:
+    """Write rows to a table with Postgres COPY.
+
+    Args:
+        cursor: psycopg2 cursor
+        table: (quoted if need be) table name
+        columns: column names, in order of row values
+        rows: rows of values, None for NULL
+
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([{
+            True: "t",
+            False: "f"
+        }.get(value, value) if isinstance(value, bool) else value
+                         for value in row])
+    buffer.seek(0)
+    cursor.copy_expert(  # type: ignore
+        "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+            table, ", ".join(columns)), buffer)
+
+
+def _next_id(cursor: object, table: str) -> int:
+    """Get the next unused id in a table.
+
+    Args:
+        cursor: psycopg2 cursor
+        table: (quoted if need be) table name
+
+    """
+    cursor.execute(  # type: ignore
+        "SELECT coalesce(max(id), 0) + 1 FROM {}".format(table))
+    return cursor.fetchone()[0]  # type: ignore
+
+
+def seed_database(app: Flask,
+                  n_users: int,
+                  attempts_per_user: int,
+                  games_per_user: int,
+                  seed: Optional[int] = 0) -> Mapping[str, int]:
+    """Add synthetic users with practice attempts and games to the database.
+
+    Tables and tricks should be set up already, see server.set_up_database.
+    Calling again adds more users after those already there.
+
+    Args:
+        app: the Flask web server application object
+        n_users: how many users to add
+        attempts_per_user: practice attempts (not in games) to add per user
+        games_per_user: games against past self to add per user
+        seed: random seed for repeatable data, None for random
+
+    Returns:
+        Counts of users, games and attempts added
+
+    """
+    rng = random.Random(seed)
+    registry = models.get_trick_registry(app)
+    difficulty_by_name = trick_difficulties()
+    difficulties = {
+        trick_id: difficulty_by_name.get(name, 1.0)
+        for trick_id, name in registry.items()
+        if registry.owner(trick_id) is None
+    }
+    now = datetime.datetime.utcnow()
+    history = datetime.timedelta(days=_HISTORY_DAYS)
+    counts = {"users": 0, "games": 0, "attempts": 0}
+
+    with app.app_context():
+        connection = models.db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        user_id = _next_id(cursor, '"user"')
+        game_id = _next_id(cursor, "game")
+
+        _copy_rows(cursor, '"user"', ("id", "name"),
+                   [(user_id + i, _USER_NAME_FORMAT.format(user_id + i))
+                    for i in range(n_users)])
+        counts["users"] = n_users
+
+        games: List[Sequence[object]] = []
+        attempts: List[Sequence[object]] = []
+        for user_id in range(user_id, user_id + n_users):
+            skater = _SyntheticSkater(rng, difficulties)
+            past_skater = _SyntheticSkater(rng, difficulties)
+
+            # Practice sessions over the history, then games the same way
+            times = sorted(now - history * rng.random()
+                           for _ in range(attempts_per_user + games_per_user))
+            game_times = set(rng.sample(range(len(times)), games_per_user))
+            for i, time in enumerate(times):
+                if i not in game_times:
+                    trick_id = skater.pick_trick()
+                    attempts.append((trick_id, None, user_id, False,
+                                     skater.attempt(trick_id), time))
+                    continue
+
+                turns, game_state = _simulate_game(skater, past_skater)
+                for turn, (trick_id, landed, is_past_self) in enumerate(turns):
+                    attempts.append(
+                        (trick_id, game_id, user_id, is_past_self, landed,
+                         time + datetime.timedelta(seconds=20 * turn)))
+                game = {"id": game_id, "user_id": user_id, "start_time": time}
+                if not game_state.is_ongoing():
+                    game.update(
+                        models._game_outcome(
+                            game_id, game_state,
+                            time + datetime.timedelta(seconds=20 * len(turns))))
+                games.append([game.get(column) for column in _GAME_COLUMNS])
+                game_id += 1
+
+            # Games first, attempts refer to them
+            if len(attempts) >= _COPY_BATCH_ROWS:
+                _copy_rows(cursor, "game", _GAME_COLUMNS, games)
+                _copy_rows(cursor, "attempt", _ATTEMPT_COLUMNS, attempts)
+                counts["games"] += len(games)
+                counts["attempts"] += len(attempts)
+                games, attempts = [], []
+                app.logger.info("Seeded %s attempts so far...",
+                                counts["attempts"])
+
+        _copy_rows(cursor, "game", _GAME_COLUMNS, games)
+        _copy_rows(cursor, "attempt", _ATTEMPT_COLUMNS, attempts)
+        counts["games"] += len(games)
+        counts["attempts"] += len(attempts)
+
+        # Explicit ids above, so move sequences past them
+        for table in ('"user"', "game"):
+            cursor.execute("SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+                           "(SELECT max(id) FROM {0}))".format(table))
+
+        # Fresh statistics, so query plans fit the new data size
+        for table in ('"user"', "game", "attempt"):
+            cursor.execute("ANALYZE {}".format(table))
+        connection.commit()
+    finally:
+        connection.close()
+
+    app.logger.info("Seeded %s users, %s games, %s attempts.", counts["users"],
+                    counts["games"], counts["attempts"])
+    return counts
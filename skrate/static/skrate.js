@@ -24,39 +24,160 @@ function refresh_game_window() {
 }
 
 
+// Times to resend an attempt that got no response, e.g. on flaky Wi-Fi
+var ATTEMPT_RETRIES = 3;
+
+
+function new_request_key() {
+  // Random key for a write, sent again on retries so it's only done once
+  return Date.now().toString(36) + "-" +
+    Math.random().toString(36).slice(2) + Math.random().toString(36).slice(2);
+}
+
+
 function record_attempt_and_update(element, is_successful) {
   // When button clicked for land or miss, make the call and update elements
   var trick_id = $(element).attr("id").split("-")[1];
-  $.ajax({
-    url: "/attempt/" + trick_id + "/" + is_successful.toString() + "/false",
-    success: function(data) {
-      // Update the trick element for new trick stats, at least
-      refresh_trick_element(trick_id);
-      // Check if the game element also needs to be updated, if so do it
-      if (data.update_game) {
-        refresh_game_window();
+  var request_key = new_request_key();
+  var retries_left = ATTEMPT_RETRIES;
+  function send() {
+    $.ajax({
+      url: "/attempt/" + trick_id + "/" + is_successful.toString() + "/false",
+      // Updated views come back with the response, saving two round trips
+      data: {fragments: true},
+      headers: {"Idempotency-Key": request_key},
+      success: function(data) {
+        var fragments = data.fragments || {};
+        // Update the trick element for new trick stats, at least
+        if (fragments.trickstats !== undefined) {
+          $("#trickstats" + trick_id).html(fragments.trickstats);
+        } else {
+          refresh_trick_element(trick_id);
+        }
+        // Check if the game element also needs to be updated, if so do it
+        if (fragments.game !== undefined) {
+          $("#outergame").html(fragments.game);
+        } else if (data.update_game) {
+          refresh_game_window();
+        }
+      },
+      error: function(xhr) {
+        // No response, resend with the same key, the server records it once
+        if (xhr.status == 0 && retries_left > 0) {
+          retries_left -= 1;
+          setTimeout(send, 500 * (ATTEMPT_RETRIES - retries_left));
+        }
+        // Out of turn, e.g. game finished from another tab, show where it's at
+        if (xhr.status == 409) {
+          refresh_game_window();
+        }
       }
-    }
-  });
+    });
+  }
+  send();
 }
 
 
-$(".btn-trick-success").click(function() {
+// Delegated, as more tricks are loaded into the list later
+$("#tricks").on("click", ".btn-trick-success", function() {
   console.log("Recording success...");
   record_attempt_and_update(this, true);
 });
 
 
-$(".btn-trick-miss").click(function() {
+$("#tricks").on("click", ".btn-trick-miss", function() {
   console.log("Recording miss...");
   record_attempt_and_update(this, false);
 });
 
 
+$("#tricks").on("click", "#moretricks", function() {
+  // Load the next page of the trick list in place of the button
+  var button = $(this);
+  $.ajax({
+    url: "/get_trick_list",
+    data: {offset: button.data("offset")},
+    success: function(response) {
+      button.replaceWith(response);
+    }
+  });
+});
+
+
+function show_trick(trick_id) {
+  // Bring a trick to the top of the list, loading it if not on a page yet
+  $("#tricksearch-results").empty();
+  var element = $("#trick" + trick_id);
+  if (element.length) {
+    $("#tricks").prepend(element);
+    return;
+  }
+  $.ajax({
+    url: "/get_single_trick_view/" + trick_id,
+    success: function(response) {
+      $("#tricks").prepend(response);
+    }
+  });
+}
+
+
+var search_timer = null;
+
+$("#tricksearch").on("input", function() {
+  // Search as the user types, once they pause
+  clearTimeout(search_timer);
+  var query = $(this).val();
+  search_timer = setTimeout(function() {
+    if (!query.trim()) {
+      $("#tricksearch-results").empty();
+      return;
+    }
+    $.ajax({
+      url: "/api/tricks/search",
+      data: {q: query},
+      success: function(data) {
+        var results = $("#tricksearch-results").empty();
+        $.each(data.tricks, function(i, trick) {
+          $("<button type='button' class='list-group-item list-group-item-action'>")
+            .text(trick.name + (trick.custom ? " (yours)" : ""))
+            .click(function() { show_trick(trick.id); })
+            .appendTo(results);
+        });
+      }
+    });
+  }, 150);
+});
+
+
+$("#addtrick").click(function() {
+  // Add what's typed in the search box as the user's own trick
+  var name = $("#tricksearch").val().trim();
+  if (!name) {
+    return;
+  }
+  $.ajax({
+    url: "/api/tricks",
+    method: "POST",
+    data: {name: name},
+    success: function(data) {
+      $("#tricksearch").val("");
+      show_trick(data.tricks[0].id);
+    },
+    error: function(xhr) {
+      alert(xhr.status == 409 ? "There's already a trick called that." :
+            "Trick names should be 1 to 64 characters.");
+    }
+  });
+});
+
+
 $("#newgame").click(function() {
   console.log("Starting new game...");
+  // Optionally against past self as of a chosen date, else as of now
+  var as_of = $("#newgame-asof").val();
   $.ajax({
     url: "/start_game",
+    data: as_of ? {as_of: as_of} : {},
     success: refresh_game_window
   });
 });
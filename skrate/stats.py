@@ -0,0 +1,206 @@
+"""Offline stats reports of users' attempts, straight from the database.
+
+Attempts are streamed off a server-side cursor, one user's history after
+another, and folded into running totals as they go by, so memory stays flat
+however long the histories. Each user's report is written out once their
+attempts are done, as CSV (a row per period, plus a lifetime row) or JSON.
+"""
+import csv
+import datetime
+import itertools
+import json
+from typing import Any, Dict, Iterator, List, Mapping, Optional, TextIO
+
+from flask import Flask
+
+from skrate import models
+
+# Period each attempt counts toward, by period name
+PERIOD_KEYS = {
+    "day": lambda time: time.strftime("%Y-%m-%d"),
+    "week": lambda time: "{}-W{:02d}".format(*time.isocalendar()[:2]),
+    "month": lambda time: time.strftime("%Y-%m"),
+}
+
+# Columns of CSV reports, a row per user and period
+CSV_COLUMNS = ("user", "period", "attempts", "lands", "land_rate",
+               "longest_streak", "current_streak", "games_won", "games_lost",
+               "games_unfinished")
+
+
+def _land_rate(attempts: int, lands: int) -> Optional[float]:
+    """Get fraction of attempts landed, None if no attempts."""
+    return lands / attempts if attempts else None
+
+
+class UserStats:
+    """Running totals of one user's attempts, fed in time order."""
+
+    def __init__(self, user_name: str, period: str) -> None:
+        """Initialize empty stats.
+
+        Args:
+            user_name: name of the user
+            period: "day", "week" or "month", per-period totals to keep
+
+        """
+        self.user_name = user_name
+        self.attempts = 0
+        self.lands = 0
+        self.longest_streak = 0
+        self.current_streak = 0
+        self.first_attempt: Optional[datetime.datetime] = None
+        self.last_attempt: Optional[datetime.datetime] = None
+        self._period_key = PERIOD_KEYS[period]
+        self._periods: Dict[str, List[int]] = {}
+        self._tricks: Dict[int, List[int]] = {}
+
+    def add_attempt(self, trick_id: int, landed: bool,
+                    time: datetime.datetime) -> None:
+        """Count the next attempt, later than any so far.
+
+        Args:
+            trick_id: id of the trick attempted
+            landed: whether landed
+            time: when it was attempted
+
+        """
+        self.attempts += 1
+        self.lands += landed
+        self.current_streak = self.current_streak + 1 if landed else 0
+        self.longest_streak = max(self.longest_streak, self.current_streak)
+        self.first_attempt = self.first_attempt or time
+        self.last_attempt = time
+        for counts in (self._periods.setdefault(self._period_key(time), [0, 0]),
+                       self._tricks.setdefault(trick_id, [0, 0])):
+            counts[0] += 1
+            counts[1] += landed
+
+    def report(self, game_record: Mapping[str, int],
+               trick_names: Mapping[int, str]) -> Mapping[str, Any]:
+        """Get the user's lifetime, per-period and per-trick stats.
+
+        Args:
+            game_record: the user's games won, lost and unfinished
+            trick_names: name of each trick by id
+
+        """
+        return {
+            "user":
+                self.user_name,
+            "attempts":
+                self.attempts,
+            "lands":
+                self.lands,
+            "land_rate":
+                _land_rate(self.attempts, self.lands),
+            "longest_streak":
+                self.longest_streak,
+            "current_streak":
+                self.current_streak,
+            "first_attempt":
+                self.first_attempt and self.first_attempt.isoformat(),
+            "last_attempt":
+                self.last_attempt and self.last_attempt.isoformat(),
+            "games":
+                dict(game_record),
+            "periods": [{
+                "period": period,
+                "attempts": attempts,
+                "lands": lands,
+                "land_rate": _land_rate(attempts, lands)
+            } for period, (attempts, lands) in sorted(self._periods.items())],
+            "tricks": [{
+                "trick": trick_names[trick_id],
+                "attempts": attempts,
+                "lands": lands,
+                "land_rate": _land_rate(attempts, lands)
+            } for trick_id, (attempts, lands) in sorted(self._tricks.items())]
+        }
+
+
+def user_reports(app: Flask,
+                 user_name: Optional[str] = None,
+                 period: str = "month") -> Iterator[Mapping[str, Any]]:
+    """Stream stats reports, of one user or every user with attempts.
+
+    Users with games but no attempts of their own aren't reported.
+
+    Args:
+        app: the Flask web server application object
+        user_name: name of the user, None for all users
+        period: "day", "week" or "month", per-period totals to report
+
+    Raises:
+        ValueError: if there's no user of that name
+
+    """
+    user_id = None
+    if user_name is not None:
+        user_id = models.lookup_user_id(app, user_name)
+        if user_id is None:
+            raise ValueError(f"No user named {user_name}.")
+        user_names = {user_id: user_name}
+    else:
+        user_names = models.get_user_names(app)
+    # Everything else is looked up before streaming, see stream_attempt_history
+    game_records = models.get_game_records(app, user_id)
+    trick_names = dict(models.get_trick_registry(app))
+    no_games = {"won": 0, "lost": 0, "unfinished": 0}
+
+    attempts = models.stream_attempt_history(app, user_id)
+    for attempter_id, user_attempts in itertools.groupby(
+            attempts, key=lambda row: row[0]):
+        stats = UserStats(user_names[attempter_id], period)
+        for _, trick_id, landed, time in user_attempts:
+            stats.add_attempt(trick_id, landed, time)
+        yield stats.report(game_records.get(attempter_id, no_games),
+                           trick_names)
+
+
+def write_csv(reports: Iterator[Mapping[str, Any]], out: TextIO) -> int:
+    """Write reports as CSV, a row per user per period then a lifetime row.
+
+    Args:
+        reports: user stats reports, from user_reports
+        out: file to write to
+
+    Returns:
+        Number of users written
+
+    """
+    writer = csv.DictWriter(out, CSV_COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    n_users = 0
+    for report in reports:
+        for period in report["periods"]:
+            writer.writerow(dict(period, user=report["user"]))
+        writer.writerow(
+            dict(report,
+                 period="lifetime",
+                 games_won=report["games"]["won"],
+                 games_lost=report["games"]["lost"],
+                 games_unfinished=report["games"]["unfinished"]))
+        n_users += 1
+    return n_users
+
+
+def write_json(reports: Iterator[Mapping[str, Any]], out: TextIO) -> int:
+    """Write reports as a JSON list, one user at a time.
+
+    Args:
+        reports: user stats reports, from user_reports
+        out: file to write to
+
+    Returns:
+        Number of users written
+
+    """
+    out.write("[")
+    n_users = 0
+    for report in reports:
+        out.write(",\n" if n_users else "\n")
+        json.dump(report, out)
+        n_users += 1
+    out.write("\n]\n")
+    return n_users
@@ -0,0 +1,188 @@
+"""In-memory search over trick names, by word prefix then fuzzily.
+
+Every word of every trick name goes in one sorted list, so the tricks with a
+word starting with a query word are a bisected range of it, e.g. "kick" finds
+"BS 180 Kickflip". If that finds too few, tricks sharing enough letter trigrams
+with the query are added, so typos like "kikflip" still find something. Shared
+tricks and each user's own are indexed apart, each on first search, so a
+search only looks at (and a new catalog only indexes) the tricks the user can
+see. The index is replaced whole when the trick catalog changes (see
+TrickRegistry).
+"""
+import bisect
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Fewest of the query's trigrams a name must have, as a fraction, to match
+# fuzzily
+_MIN_FUZZY_SHARE = 0.4
+
+
+def _words(text: str) -> List[str]:
+    """Get lower case words of a trick name or query, e.g. shove, it."""
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _trigrams(text: str) -> Set[str]:
+    """Get letter trigrams of a name or query, words padded with spaces."""
+    padded = "  " + " ".join(_words(text)) + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _NameIndex:
+    """Word prefix and trigram index over one owner's tricks."""
+
+    def __init__(self, tricks: Iterable[Tuple[int, str]]) -> None:
+        """Build the index.
+
+        Args:
+            tricks: (id, name) of each trick
+
+        """
+        self.normalized: Dict[int, str] = {}
+        self.trigrams: Dict[int, Set[str]] = {}
+        self._words: List[Tuple[str, int]] = []
+        self._trigram_tricks: Dict[str, List[int]] = {}
+        for trick_id, name in tricks:
+            words = _words(name)
+            self.normalized[trick_id] = " ".join(words)
+            self._words.extend((word, trick_id) for word in set(words))
+            self.trigrams[trick_id] = _trigrams(name)
+            for trigram in self.trigrams[trick_id]:
+                self._trigram_tricks.setdefault(trigram, []).append(trick_id)
+        self._words.sort()
+
+    def with_word_prefix(self, prefix: str) -> Set[int]:
+        """Get ids of tricks with a word starting with prefix.
+
+        Args:
+            prefix: start of a word, lower case
+
+        """
+        found = set()
+        for i in range(bisect.bisect_left(self._words, (prefix, -1)),
+                       len(self._words)):
+            word, trick_id = self._words[i]
+            if not word.startswith(prefix):
+                break
+            found.add(trick_id)
+        return found
+
+    def count_shared_trigrams(self, trigrams: Set[str],
+                              shared: Dict[int, int]) -> None:
+        """Count trigrams each trick has in common with the query.
+
+        Args:
+            trigrams: trigrams of the query
+            shared: counts by trick id, added to
+
+        """
+        for trigram in trigrams:
+            for trick_id in self._trigram_tricks.get(trigram, ()):
+                shared[trick_id] = shared.get(trick_id, 0) + 1
+
+
+class TrickSearchIndex:
+    """Name search over shared tricks and users' own."""
+
+    def __init__(self, tricks: Iterable[Tuple[int, str,
+                                              Optional[int]]]) -> None:
+        """Build the index.
+
+        Args:
+            tricks: (id, name, owner user id or None if shared) of each trick
+
+        """
+        self._names: Dict[int, str] = {}
+        self._owners: Dict[int, Optional[int]] = {}
+        self._owner_tricks: Dict[Optional[int], List[Tuple[int, str]]] = {}
+        for trick_id, name, owner_id in tricks:
+            self._names[trick_id] = name
+            self._owners[trick_id] = owner_id
+            self._owner_tricks.setdefault(owner_id, []).append((trick_id, name))
+        self._by_owner: Dict[Optional[int], _NameIndex] = {}
+
+    def _visible_indexes(self, user_id: Optional[int]) -> List[_NameIndex]:
+        """Get indexes of shared tricks and the user's own, building if new."""
+        indexes = []
+        for owner in [None] if user_id is None else [None, user_id]:
+            index = self._by_owner.get(owner)
+            if index is None and owner in self._owner_tricks:
+                # A concurrent duplicate build is harmless
+                index = _NameIndex(self._owner_tricks[owner])
+                self._by_owner[owner] = index
+            if index is not None:
+                indexes.append(index)
+        return indexes
+
+    def _prefix_matches(self, query_words: List[str],
+                        user_id: Optional[int]) -> List[int]:
+        """Get tricks with a word starting with each query word, best first.
+
+        Names starting with the query come first, then shorter names.
+
+        Args:
+            query_words: words of what the user typed
+            user_id: id of the user searching
+
+        """
+        query_start = " ".join(query_words)
+        ranked = []
+        for index in self._visible_indexes(user_id):
+            matches = index.with_word_prefix(query_words[0])
+            for word in query_words[1:]:
+                matches &= index.with_word_prefix(word)
+            ranked.extend(
+                (not index.normalized[trick_id].startswith(query_start),
+                 len(self._names[trick_id]), self._names[trick_id], trick_id)
+                for trick_id in matches)
+        return [trick_id for _, _, _, trick_id in sorted(ranked)]
+
+    def _fuzzy_matches(self, query: str, user_id: Optional[int],
+                       exclude: Set[int]) -> List[int]:
+        """Get tricks with most of the query's trigrams, closest first.
+
+        Args:
+            query: what the user typed
+            user_id: id of the user searching
+            exclude: ids of tricks already found
+
+        """
+        query_trigrams = _trigrams(query)
+        scored = []
+        for index in self._visible_indexes(user_id):
+            shared: Dict[int, int] = {}
+            index.count_shared_trigrams(query_trigrams, shared)
+            for trick_id, n_shared in shared.items():
+                if trick_id in exclude or \
+                        n_shared < _MIN_FUZZY_SHARE * len(query_trigrams):
+                    continue
+                # Ties on trigrams in common go to names with fewer others
+                similarity = n_shared / (len(query_trigrams) + len(
+                    index.trigrams[trick_id]) - n_shared)
+                scored.append(
+                    (-n_shared, -similarity, self._names[trick_id], trick_id))
+        return [trick_id for _, _, _, trick_id in sorted(scored)]
+
+    def search(self, query: str, user_id: Optional[int],
+               limit: int) -> List[Tuple[int, str, bool]]:
+        """Find tricks a user can see by name, prefix matches first.
+
+        Args:
+            query: what the user typed, e.g. "fs kick" or "kikflip"
+            user_id: id of the user searching, for their own tricks
+            limit: most tricks to return
+
+        Returns:
+            (id, name, whether the user's own) of each trick found
+
+        """
+        query_words = _words(query)
+        if not query_words:
+            return []
+        found = self._prefix_matches(query_words, user_id)[:limit]
+        if len(found) < limit:
+            found += self._fuzzy_matches(query, user_id,
+                                         set(found))[:limit - len(found)]
+        return [(trick_id, self._names[trick_id], self._owners[trick_id]
+                 is not None) for trick_id in found]
@@ -4,6 +4,7 @@ from typing import List, Optional, Tuple
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
 
 from skrate import models
 
@@ -72,6 +73,62 @@ def all_tricks_variants() -> List[str]:
                             for trick_tuple in _TRICKS))
 
 
+class TrickNameTakenError(ValueError):
+    """A custom trick named the same as a shared trick, or one of the user's."""
+
+
+def add_custom_tricks(app: Flask,
+                      user_id: int,
+                      name: str,
+                      all_stances: bool = False) -> List[int]:
+    """Add a user's own trick to the catalog, only they see it.
+
+    Args:
+        app: the Flask web service app
+        user_id: id of the user adding it
+        name: name of the trick, e.g. "BS 50-50 to Manual"
+        all_stances: also add nollie, switch and fakie versions
+
+    Returns:
+        ids of the tricks added
+
+    Raises:
+        TrickNameTakenError: if the user already has a trick of that name
+        ValueError: if the name is empty or too long
+
+    """
+    name = " ".join(name.split())
+    names = trick_variants((name, True, True, True)) if all_stances else [name]
+    if not name or max(map(len, names)) > models.TRICK_NAME_MAX_LENGTH:
+        raise ValueError("Trick names should be 1 to "
+                         f"{models.TRICK_NAME_MAX_LENGTH} characters.")
+    registry = models.get_trick_registry(app)
+    taken = {
+        registry[trick_id].lower() for trick_id in registry.visible_to(user_id)
+    }
+    if any(trick_name.lower() in taken for trick_name in names):
+        raise TrickNameTakenError(f"There's already a trick called {name}.")
+
+    with app.app_context():
+        new_tricks = [
+            models.Trick(name=trick_name, owner_id=user_id)
+            for trick_name in names
+        ]
+        models.db.session.add_all(new_tricks)
+        try:
+            models.db.session.commit()
+        except IntegrityError:
+            # Added by another request just before us
+            models.db.session.rollback()
+            raise TrickNameTakenError(f"There's already a trick called {name}.")
+        trick_ids = [trick.id for trick in new_tricks]
+    app.logger.info("User %s added tricks %s", user_id, names)
+
+    registry.refresh()
+    models.replicate_tricks(app, trick_ids)
+    return trick_ids
+
+
 def update_tricks_table(app: Flask) -> None:
     """Update the tricks table. Maintain any existing ID's.
     
@@ -80,10 +137,20 @@ def update_tricks_table(app: Flask) -> None:
 
     """
     with app.app_context():
+        any_added = False
         for trick_name in all_tricks_variants():
             # Store tricks if they're not already there
-            if not models.Trick.query.filter_by(name=trick_name).count():
+            if not models.Trick.query.filter_by(name=trick_name,
+                                                owner_id=None).count():
                 app.logger.info("Adding trick: %s" % trick_name)
                 new_trick = models.Trick(name=trick_name)
                 models.db.session.add(new_trick)
                 models.db.session.commit()  # auto-assigns ID on commit
+                any_added = True
+
+    # Catalog changed, so in-memory lookup of tricks needs reloading
+    if any_added:
+        models.get_trick_registry(app).refresh()
+
+    # Shards get the whole catalog each time, in case any were just added
+    models.replicate_tricks(app)